@@ -4,7 +4,7 @@ Type stubs for the rulebox module.
 This module provides Python bindings for the Rust-based RuleBox text labeling engine.
 """
 
-from typing import List, Union, Collection
+from typing import Any, Collection, Iterable, List, Optional, Union
 from pathlib import Path
 
 class RuleBox:
@@ -27,6 +27,9 @@ class RuleBox:
         """
         Load a RuleBox from a JSON rules file.
 
+        Loaded rules are cached by path, so loading a file again reuses the
+        compiled rules unless the file has been modified since.
+
         Args:
             path: Path to the JSON file containing rule definitions.
                   Can be a string path or pathlib.Path object.
@@ -43,6 +46,54 @@ class RuleBox:
         """
         ...
 
+    def to_cache(self, path: Union[str, Path]) -> None:
+        """
+        Save the rules together with their compiled matcher, for ``from_cache``.
+
+        A cache file can only be loaded by the same version of rulebox on a
+        machine with the same byte order.
+
+        Args:
+            path: Where to write the cache file.
+
+        Raises:
+            OSError: If the file can't be written.
+        """
+        ...
+
+    @staticmethod
+    def from_cache(path: Union[str, Path]) -> "RuleBox":
+        """
+        Load a RuleBox from a file written by ``to_cache``.
+
+        This is faster than ``from_path`` for large rule sets, as the combined
+        matcher is loaded rather than built again. The slower regex it stands
+        in for is only built if a text needs it (non-ASCII text next to a
+        ``\\b`` word boundary).
+
+        Args:
+            path: Path to the cache file.
+
+        Returns:
+            A new RuleBox instance with the cached rules.
+
+        Raises:
+            OSError: If the file can't be read, or was written by a different
+                     version of rulebox.
+
+        Example:
+            >>> RuleBox.from_path("rules.json").to_cache("rules.cache")
+            >>> rulebox = RuleBox.from_cache("rules.cache")
+        """
+        ...
+
+    @staticmethod
+    def clear_cache() -> None:
+        """
+        Forget every RuleBox cached by ``from_path``.
+        """
+        ...
+
     def assign_labels(self, text: str) -> List[str]:
         """
         Assign labels to a single text string.
@@ -61,12 +112,21 @@ class RuleBox:
         """
         ...
 
-    def assign_labels_vector(self, texts: Collection[str]) -> Collection[List[str]]:
+    def assign_labels_vector(
+        self, texts: Iterable[Optional[str]], parallel: Optional[bool] = None
+    ) -> Collection[List[str]]:
         """
         Assign labels to multiple text strings efficiently.
 
         Args:
-            texts: A list of text strings to analyze and label.
+            texts: An iterable of text strings to analyze and label, such as
+                   a list, tuple, pandas Series or NumPy array. The strings
+                   are read in place without being copied. Missing values
+                   (None, NaN, pandas.NA) are labelled as empty text.
+            parallel: Whether to label large batches across multiple threads.
+                      Defaults to true unless the RULEBOX_PARALLELISM
+                      environment variable is set to a false value such as
+                      "false" or "0".
 
         Returns:
             A list of label lists, where each inner list contains
@@ -77,5 +137,36 @@ class RuleBox:
             >>> texts = ["Hello there", "Goodbye", "Hi everyone"]
             >>> labels = rulebox.assign_labels_vector(texts)
             >>> print(labels)  # [['greeting'], [], ['greeting']]
+
+        Raises:
+            TypeError: If ``texts`` is a single string or contains values
+                       that are neither strings nor missing values.
+        """
+        ...
+
+    def assign_labels_arrow(
+        self, texts: Iterable[Optional[str]], parallel: Optional[bool] = None
+    ) -> Any:
+        """
+        Assign labels to multiple text strings, returning a pyarrow array.
+
+        Requires pyarrow (``pip install rulebox[arrow]``). Takes the same
+        arguments as ``assign_labels_vector``, and also accepts pyarrow arrays
+        and chunked arrays. ``string`` and ``large_string`` arrays are read
+        from their Arrow buffers without copying; other pyarrow types are
+        converted to Python strings first.
+
+        Returns:
+            A ``pyarrow.ListArray`` with one list of labels per input text. The
+            labels are dictionary-encoded over the ruleset's labels, so no Python
+            object is created per row, and the result can be wrapped as a pandas
+            or polars column without copying.
+
+        Example:
+            >>> rulebox = RuleBox.from_path("rules.json")
+            >>> texts = pd.Series(["Hello there", "Goodbye", "Hi everyone"])
+            >>> labels = pd.Series(
+            ...     pd.arrays.ArrowExtensionArray(rulebox.assign_labels_arrow(texts))
+            ... )
         """
         ...
@@ -1,59 +1,459 @@
+use pyo3::buffer::PyBuffer;
+use pyo3::exceptions::{PyOverflowError, PyTypeError, PyValueError};
+use pyo3::intern;
 use pyo3::prelude::*;
-use pyo3::types::PyAny;
-use rulebox_rust::RuleBox as RustRuleBox;
+use pyo3::types::{PyAny, PyBytes, PyFloat, PyList, PyString};
+use rulebox_rust::{mask_label_ids, RuleBox as RustRuleBox};
+use std::collections::HashMap;
+use std::fs;
 use std::path::PathBuf;
+use std::sync::{Arc, Mutex, MutexGuard, OnceLock, PoisonError};
+use std::time::SystemTime;
+
+#[cfg(feature = "mimalloc")]
+#[global_allocator]
+static GLOBAL: mimalloc::MiMalloc = mimalloc::MiMalloc;
 
 /// A Python wrapper for the Rust RuleBox
 #[pyclass]
 pub struct RuleBox {
-    inner: RustRuleBox,
+    inner: Arc<RustRuleBox>,
+    // Interned Python copies of inner.label_names(), shared by every result list
+    labels: Vec<Py<PyString>>,
 }
 
+// Identifies one version of a rules file: its modification time and size
+type FileVersion = (SystemTime, u64);
+
+// RuleBoxes loaded by from_path, keyed by canonical path, so reloading an
+// unchanged rules file skips parsing the JSON and compiling the regexes again
+type PathCache = HashMap<PathBuf, (FileVersion, Arc<RustRuleBox>)>;
+static PATH_CACHE: OnceLock<Mutex<PathCache>> = OnceLock::new();
+
 #[pymethods]
 impl RuleBox {
     /// Create a RuleBox from a JSON string
     #[staticmethod]
-    fn from_json(json: String) -> PyResult<Self> {
+    fn from_json(py: Python<'_>, json: String) -> PyResult<Self> {
         let rulebox = RustRuleBox::from_json(&json)
             .map_err(|e| PyErr::new::<pyo3::exceptions::PyValueError, _>(e.to_string()))?;
-        Ok(RuleBox { inner: rulebox })
+        Ok(RuleBox::new(py, Arc::new(rulebox)))
     }
 
     /// Create a RuleBox from a JSON file path (accepts either string or Path object)
+    ///
+    /// Loaded files are cached: loading the same unchanged file again reuses the
+    /// already compiled rules.
     #[staticmethod]
-    fn from_path(path: Bound<'_, PyAny>) -> PyResult<Self> {
+    fn from_path(py: Python<'_>, path: Bound<'_, PyAny>) -> PyResult<Self> {
         let path_str = extract_path_string(&path)
             .map_err(|e| PyErr::new::<pyo3::exceptions::PyTypeError, _>(e.to_string()))?;
 
-        match RustRuleBox::from_path(&path_str) {
-            Ok(rulebox) => Ok(RuleBox { inner: rulebox }),
+        match load_cached(&path_str) {
+            Ok(rulebox) => Ok(RuleBox::new(py, rulebox)),
             Err(e) => Err(PyErr::new::<pyo3::exceptions::PyIOError, _>(
                 format!("Failed to load RuleBox from path '{}': {}", path_str, e).to_string(),
             )),
         }
     }
 
+    /// Save the rules and their compiled matcher to a cache file for from_cache
+    fn to_cache(&self, path: Bound<'_, PyAny>) -> PyResult<()> {
+        let path_str = extract_path_string(&path)
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyTypeError, _>(e.to_string()))?;
+
+        self.inner.to_cache(&path_str).map_err(|e| {
+            PyErr::new::<pyo3::exceptions::PyIOError, _>(format!(
+                "Failed to write RuleBox cache to path '{}': {}",
+                path_str, e
+            ))
+        })
+    }
+
+    /// Create a RuleBox from a cache file written by to_cache, skipping most of
+    /// the work of compiling the rules
+    #[staticmethod]
+    fn from_cache(py: Python<'_>, path: Bound<'_, PyAny>) -> PyResult<Self> {
+        let path_str = extract_path_string(&path)
+            .map_err(|e| PyErr::new::<pyo3::exceptions::PyTypeError, _>(e.to_string()))?;
+
+        match RustRuleBox::from_cache(&path_str) {
+            Ok(rulebox) => Ok(RuleBox::new(py, Arc::new(rulebox))),
+            Err(e) => Err(PyErr::new::<pyo3::exceptions::PyIOError, _>(format!(
+                "Failed to load RuleBox cache from path '{}': {}",
+                path_str, e
+            ))),
+        }
+    }
+
+    /// Forget every RuleBox cached by from_path
+    #[staticmethod]
+    fn clear_cache() {
+        path_cache().clear();
+    }
+
     /// Assign labels to a single text and return them as a list of strings
-    fn assign_labels(&self, text: String) -> PyResult<Vec<String>> {
-        Ok(self.inner.assign_labels(&text))
+    fn assign_labels<'py>(&self, py: Python<'py>, text: &str) -> PyResult<Bound<'py, PyList>> {
+        let mask = self.inner.assign_label_mask(text);
+        Ok(self.label_list(py, &mask))
     }
 
     /// Assign labels to multiple texts and return them as a list of lists of strings
-    fn assign_labels_vector(&self, texts: Vec<String>) -> PyResult<Vec<Vec<String>>> {
-        Ok(self.inner.assign_labels_vector(&texts))
+    ///
+    /// Accepts any iterable of strings (list, tuple, pandas Series, NumPy array).
+    /// The text is borrowed from the Python string objects rather than copied.
+    /// Missing values (None, NaN, pandas.NA) are labelled as empty text.
+    /// Labelling runs without the GIL, across multiple threads unless `parallel`
+    /// is false (it defaults to the RULEBOX_PARALLELISM environment variable).
+    #[pyo3(signature = (texts, parallel = None))]
+    fn assign_labels_vector<'py>(
+        &self,
+        py: Python<'py>,
+        texts: &Bound<'_, PyAny>,
+        parallel: Option<bool>,
+    ) -> PyResult<Bound<'py, PyList>> {
+        let (masks, count) = self.label_masks(py, texts, parallel)?;
+        let words = self.inner.label_mask_words();
+        let rows = (0..count).map(|row| self.label_list(py, &masks[row * words..][..words]));
+        Ok(PyList::new_bound(py, rows))
+    }
+
+    /// Assign labels to multiple texts and return them as a pyarrow ListArray
+    ///
+    /// Takes the same arguments as assign_labels_vector. Each row is a list of
+    /// dictionary-encoded strings over the ruleset's labels, so no Python object
+    /// is created per row or per label, and the result converts to a pandas or
+    /// polars column without copying. Requires pyarrow.
+    #[pyo3(signature = (texts, parallel = None))]
+    fn assign_labels_arrow<'py>(
+        &self,
+        py: Python<'py>,
+        texts: &Bound<'_, PyAny>,
+        parallel: Option<bool>,
+    ) -> PyResult<Bound<'py, PyAny>> {
+        let pa = py.import_bound("pyarrow")?;
+        let (masks, count) = self.label_masks(py, texts, parallel)?;
+        let words = self.inner.label_mask_words();
+
+        let (offsets, indices) = py.allow_threads(|| {
+            let mut offsets = Vec::with_capacity(count + 1);
+            let mut indices = Vec::new();
+            offsets.push(0);
+            for row in 0..count {
+                indices.extend(mask_label_ids(&masks[row * words..][..words]));
+                offsets.push(indices.len());
+            }
+            (offsets, indices)
+        });
+
+        let dictionary = pa.call_method1(
+            "array",
+            (
+                PyList::new_bound(py, &self.labels),
+                pa.call_method0("string")?,
+            ),
+        )?;
+        let labels = pa
+            .getattr("DictionaryArray")?
+            .call_method1("from_arrays", (int32_array(&pa, &indices)?, dictionary))?;
+        pa.getattr("ListArray")?
+            .call_method1("from_arrays", (int32_array(&pa, &offsets)?, labels))
+    }
+}
+
+impl RuleBox {
+    fn new(py: Python<'_>, inner: Arc<RustRuleBox>) -> Self {
+        let labels = inner
+            .label_names()
+            .iter()
+            .map(|label| PyString::intern_bound(py, label).unbind())
+            .collect();
+        RuleBox { inner, labels }
+    }
+
+    // The label masks of `texts`, as laid out by assign_label_masks_vector, and
+    // the number of texts
+    fn label_masks(
+        &self,
+        py: Python<'_>,
+        texts: &Bound<'_, PyAny>,
+        parallel: Option<bool>,
+    ) -> PyResult<(Vec<u64>, usize)> {
+        // pyarrow string arrays are read from their buffers, anything else
+        // from its Python string objects; both are borrowed rather than copied
+        let chunks = arrow_string_chunks(texts)?;
+        let items;
+        let texts = match &chunks {
+            Some(chunks) => {
+                let mut texts = Vec::new();
+                for chunk in chunks {
+                    chunk.push_texts(&mut texts)?;
+                }
+                texts
+            }
+            None => {
+                items = extract_text_items(texts)?;
+                items
+                    .iter()
+                    .map(|item| item.as_ref().map_or(Ok(""), |text| text.to_str()))
+                    .collect::<PyResult<Vec<&str>>>()?
+            }
+        };
+
+        let parallel = parallel.unwrap_or_else(parallelism_enabled);
+        let inner = &self.inner;
+        // One packed bitmask per text while matching; label strings only at the end
+        let masks = py.allow_threads(|| {
+            if parallel {
+                inner.par_assign_label_masks_vector(&texts)
+            } else {
+                inner.assign_label_masks_vector(&texts)
+            }
+        });
+        Ok((masks, texts.len()))
+    }
+
+    // A list of the (shared) label strings for the labels set in `mask`
+    fn label_list<'py>(&self, py: Python<'py>, mask: &[u64]) -> Bound<'py, PyList> {
+        let labels: Vec<Py<PyString>> = mask_label_ids(mask)
+            .map(|id| self.labels[id].clone_ref(py))
+            .collect();
+        PyList::new_bound(py, labels)
+    }
+}
+
+/// Helper function to read the RULEBOX_PARALLELISM environment variable, which
+/// disables multi-threaded labelling when set to a false value
+fn parallelism_enabled() -> bool {
+    match std::env::var("RULEBOX_PARALLELISM") {
+        Ok(value) => !matches!(
+            value.to_ascii_lowercase().as_str(),
+            "0" | "false" | "no" | "off"
+        ),
+        Err(_) => true,
+    }
+}
+
+/// Helper function to collect the string items of an iterable without copying
+/// them, with `None` standing in for missing values
+fn extract_text_items<'py>(
+    texts: &Bound<'py, PyAny>,
+) -> PyResult<Vec<Option<Bound<'py, PyString>>>> {
+    // A str is itself iterable, but labelling it character by character is never intended
+    if texts.is_instance_of::<PyString>() {
+        return Err(PyTypeError::new_err(
+            "texts must be an iterable of strings, not a single string",
+        ));
+    }
+
+    // pyarrow arrays iterate as pyarrow scalars rather than strings; string
+    // arrays never get here (see arrow_string_chunks), other types are converted
+    let texts = if is_arrow_array(texts)? {
+        texts.call_method0(intern!(texts.py(), "to_pylist"))?
+    } else {
+        texts.clone()
+    };
+
+    let mut items = Vec::with_capacity(texts.len().unwrap_or(0));
+    for item in texts.iter()? {
+        let item = item?;
+        if is_missing(&item)? {
+            items.push(None);
+        } else {
+            items.push(Some(item.downcast_into::<PyString>()?));
+        }
+    }
+    Ok(items)
+}
+
+/// Helper function to recognise the missing-value markers pandas and NumPy use
+fn is_missing(item: &Bound<'_, PyAny>) -> PyResult<bool> {
+    if item.is_instance_of::<PyString>() {
+        return Ok(false);
+    }
+    if item.is_none() {
+        return Ok(true);
+    }
+    if let Ok(float) = item.downcast::<PyFloat>() {
+        return Ok(float.value().is_nan());
+    }
+    // pandas.NA, checked by type name to avoid importing pandas
+    let type_name = item.get_type().getattr(intern!(item.py(), "__name__"))?;
+    Ok(type_name.extract::<&str>()? == "NAType")
+}
+
+/// Helper function to recognise pyarrow arrays and chunked arrays, checked by
+/// module name to avoid importing pyarrow
+fn is_arrow_array(texts: &Bound<'_, PyAny>) -> PyResult<bool> {
+    let py = texts.py();
+    let module = texts.get_type().getattr(intern!(py, "__module__"))?;
+    Ok(module.extract::<&str>()?.starts_with("pyarrow")
+        && texts.hasattr(intern!(py, "to_pylist"))?)
+}
+
+/// The buffers of one pyarrow string or large_string array, held through the
+/// buffer protocol so the text can be read in place
+struct ArrowStrings {
+    offset: usize,
+    len: usize,
+    large: bool,
+    validity: Option<PyBuffer<i8>>,
+    offsets: Option<PyBuffer<i8>>,
+    data: Option<PyBuffer<i8>>,
+}
+
+impl ArrowStrings {
+    fn new(array: &Bound<'_, PyAny>, large: bool) -> PyResult<Self> {
+        let py = array.py();
+        let buffers = array.call_method0(intern!(py, "buffers"))?;
+        let buffers = buffers.downcast::<PyList>()?;
+        let buffer = |index: usize| -> PyResult<Option<PyBuffer<i8>>> {
+            let buffer = buffers.get_item(index)?;
+            if buffer.is_none() {
+                return Ok(None);
+            }
+            let buffer = PyBuffer::get_bound(&buffer)?;
+            if !buffer.is_c_contiguous() {
+                return Err(PyValueError::new_err("pyarrow buffer is not contiguous"));
+            }
+            Ok(Some(buffer))
+        };
+        Ok(ArrowStrings {
+            offset: array.getattr(intern!(py, "offset"))?.extract()?,
+            len: array.len()?,
+            large,
+            validity: buffer(0)?,
+            offsets: buffer(1)?,
+            data: buffer(2)?,
+        })
+    }
+
+    // Append this array's texts to `texts`, with nulls as empty text
+    fn push_texts<'a>(&'a self, texts: &mut Vec<&'a str>) -> PyResult<()> {
+        let malformed = || PyValueError::new_err("malformed pyarrow string array");
+        let validity = self.validity.as_ref().map(buffer_bytes);
+        let offsets = self.offsets.as_ref().map_or(&[][..], buffer_bytes);
+        let data = self.data.as_ref().map_or(&[][..], buffer_bytes);
+        let width = if self.large { 8 } else { 4 };
+        let offset_at = |index: usize| -> Option<usize> {
+            let bytes = offsets.get(index * width..(index + 1) * width)?;
+            if self.large {
+                usize::try_from(i64::from_ne_bytes(bytes.try_into().ok()?)).ok()
+            } else {
+                usize::try_from(i32::from_ne_bytes(bytes.try_into().ok()?)).ok()
+            }
+        };
+
+        texts.reserve(self.len);
+        for index in self.offset..self.offset + self.len {
+            let valid = validity.map_or(true, |bits| {
+                bits.get(index / 8)
+                    .is_some_and(|byte| byte >> (index % 8) & 1 == 1)
+            });
+            if !valid {
+                texts.push("");
+                continue;
+            }
+            let start = offset_at(index).ok_or_else(malformed)?;
+            let end = offset_at(index + 1).ok_or_else(malformed)?;
+            let bytes = data.get(start..end).ok_or_else(malformed)?;
+            texts.push(std::str::from_utf8(bytes).map_err(|_| malformed())?);
+        }
+        Ok(())
+    }
+}
+
+/// Helper function to view a pyarrow buffer as bytes
+fn buffer_bytes(buffer: &PyBuffer<i8>) -> &[u8] {
+    // Safety: the buffer is contiguous (checked in ArrowStrings::new) and stays
+    // valid for as long as the PyBuffer holds it
+    unsafe { std::slice::from_raw_parts(buffer.buf_ptr() as *const u8, buffer.len_bytes()) }
+}
+
+/// Helper function to borrow the chunks of a pyarrow string or large_string
+/// array or chunked array, or `None` for any other input
+fn arrow_string_chunks(texts: &Bound<'_, PyAny>) -> PyResult<Option<Vec<ArrowStrings>>> {
+    let py = texts.py();
+    if !is_arrow_array(texts)? {
+        return Ok(None);
+    }
+    let large = match texts.getattr(intern!(py, "type"))?.str()?.to_str()? {
+        "string" => false,
+        "large_string" => true,
+        _ => return Ok(None),
+    };
+
+    // A ChunkedArray is read one chunk at a time
+    if texts.hasattr(intern!(py, "chunks"))? {
+        let chunks = texts.getattr(intern!(py, "chunks"))?;
+        let chunks = chunks
+            .iter()?
+            .map(|chunk| ArrowStrings::new(&chunk?, large))
+            .collect::<PyResult<_>>()?;
+        return Ok(Some(chunks));
+    }
+    Ok(Some(vec![ArrowStrings::new(texts, large)?]))
+}
+
+/// Helper function to build a pyarrow int32 array from label ids or offsets,
+/// packed into a bytes object that pyarrow wraps without copying again
+fn int32_array<'py>(pa: &Bound<'py, PyModule>, values: &[usize]) -> PyResult<Bound<'py, PyAny>> {
+    let py = pa.py();
+    let mut bytes = Vec::with_capacity(values.len() * 4);
+    for &value in values {
+        let value = i32::try_from(value)
+            .map_err(|_| PyOverflowError::new_err("too many labels for a pyarrow ListArray"))?;
+        bytes.extend_from_slice(&value.to_ne_bytes());
+    }
+    let buffer = pa.call_method1("py_buffer", (PyBytes::new_bound(py, &bytes),))?;
+    pa.getattr("Array")?.call_method1(
+        "from_buffers",
+        (
+            pa.call_method0("int32")?,
+            values.len(),
+            PyList::new_bound(py, [py.None(), buffer.unbind()]),
+        ),
+    )
+}
+
+fn path_cache() -> MutexGuard<'static, PathCache> {
+    PATH_CACHE
+        .get_or_init(Default::default)
+        .lock()
+        .unwrap_or_else(PoisonError::into_inner)
+}
+
+/// Helper function to load a RuleBox from a path, reusing the cached one if the file is unchanged
+fn load_cached(path: &str) -> Result<Arc<RustRuleBox>, Box<dyn std::error::Error>> {
+    let canonical = fs::canonicalize(path)?;
+    let metadata = fs::metadata(&canonical)?;
+    let version = (metadata.modified()?, metadata.len());
+
+    if let Some((cached_version, rulebox)) = path_cache().get(&canonical) {
+        if *cached_version == version {
+            return Ok(Arc::clone(rulebox));
+        }
     }
+
+    // Compile without holding the lock
+    let rulebox = Arc::new(RustRuleBox::from_path(path)?);
+    path_cache().insert(canonical, (version, Arc::clone(&rulebox)));
+    Ok(rulebox)
 }
 
 /// Helper function to extract a path string from either a String or PathBuf
 fn extract_path_string(path: &Bound<'_, PyAny>) -> Result<String, &'static str> {
-    // Try PathBuf first (handles pathlib.Path objects)
-    if let Ok(pathbuf) = path.extract::<PathBuf>() {
-        return Ok(pathbuf.to_string_lossy().to_string());
+    // Plain strings first: extracting a PathBuf calls os.fspath() on anything
+    if let Ok(string_path) = path.downcast::<PyString>() {
+        if let Ok(string_path) = string_path.to_str() {
+            return Ok(string_path.to_owned());
+        }
     }
 
-    // Try String next
-    if let Ok(string_path) = path.extract::<String>() {
-        return Ok(string_path);
+    // Then PathBuf (handles pathlib.Path objects, and strings that aren't
+    // valid UTF-8)
+    if let Ok(pathbuf) = path.extract::<PathBuf>() {
+        return Ok(pathbuf.to_string_lossy().to_string());
     }
 
     // Neither worked
@@ -2,12 +2,34 @@
 Pytest configuration and shared fixtures for RuleBox tests.
 """
 
+import json
+
 import pytest
-import sys
-import os
+from rulebox import RuleBox
+
+# Rules for the session-wide shared_rulebox
+SHARED_RULES_JSON = json.dumps(
+    [
+        {
+            "label": "greeting",
+            "rule": {
+                "or_patterns": [
+                    {"pattern": "\\bhello\\b", "flags": ["i"]},
+                    {"pattern": "\\bhi\\b", "flags": ["i"]},
+                ]
+            },
+        }
+    ]
+)
+
 
-# Add the parent directory to the path so we can import rulebox
-sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+@pytest.fixture(scope="session")
+def shared_rulebox():
+    """A RuleBox labelling greetings, compiled once for the whole test session."""
+    rulebox = RuleBox.from_json(SHARED_RULES_JSON)
+    # Make its first (slower) match here, rather than in a test
+    rulebox.assign_labels("warmup")
+    return rulebox
 
 
 def pytest_configure(config):
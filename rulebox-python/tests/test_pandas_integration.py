@@ -3,16 +3,14 @@ Tests for pandas integration with RuleBox Python bindings.
 """
 
 import json
-import tempfile
-import os
 import pytest
 import pandas as pd
 from rulebox import RuleBox
 
 
-@pytest.fixture
-def sample_rules_file():
-    """Create a temporary rules file for testing."""
+@pytest.fixture(scope="session")
+def sample_rules_file(tmp_path_factory):
+    """Create a temporary rules file, shared by every test that only reads it."""
     rules = [
         {
             "label": "greeting",
@@ -35,17 +33,9 @@ def sample_rules_file():
         },
     ]
 
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".json", delete=False) as f:
-        json.dump(rules, f, indent=2)
-        temp_file = f.name
-
-    yield temp_file
-
-    # Cleanup
-    try:
-        os.unlink(temp_file)
-    except FileNotFoundError:
-        pass
+    rules_file = tmp_path_factory.mktemp("rules") / "rules.json"
+    rules_file.write_text(json.dumps(rules))
+    return str(rules_file)
 
 
 class TestPandasIntegration:
@@ -239,6 +229,71 @@ class TestPandasIntegration:
             assert len(all_labels) == 5  # All values, NA replaced with empty string
             print("✓ pandas Series with NA values (fillna strategy) works")
 
+    def test_assign_labels_vector_treats_missing_values_as_empty(
+        self, sample_rules_file
+    ):
+        """Test that NA/NaN/None values are labelled as empty text in place."""
+        rulebox = RuleBox.from_path(sample_rules_file)
+
+        series_with_na = pd.Series(
+            ["Hello world", pd.NA, "What's up?", None, float("nan")]
+        )
+
+        all_labels = rulebox.assign_labels_vector(series_with_na)
+
+        assert all_labels == [["greeting"], [], ["question"], [], []]
+        assert all_labels == rulebox.assign_labels_vector(
+            series_with_na.fillna("").tolist()
+        )
+
+    def test_assign_labels_arrow_matches_vector(self, sample_rules_file):
+        """Test assign_labels_arrow returns the same labels as assign_labels_vector."""
+        pa = pytest.importorskip("pyarrow")
+        rulebox = RuleBox.from_path(sample_rules_file)
+
+        texts = pd.Series(
+            ["Hello world", "Is this a question?", None, "Hi! Email test@example.com?"]
+        )
+        labels = rulebox.assign_labels_arrow(texts)
+
+        assert isinstance(labels, pa.ListArray)
+        assert pa.types.is_dictionary(labels.type.value_type)
+        assert labels.to_pylist() == rulebox.assign_labels_vector(texts)
+
+        column = pd.Series(pd.arrays.ArrowExtensionArray(labels))
+        assert len(column) == len(texts)
+
+    def test_assign_labels_arrow_accepts_arrow_strings(self, sample_rules_file):
+        """Test assign_labels_arrow accepts pyarrow string arrays, nulls included."""
+        pa = pytest.importorskip("pyarrow")
+        rulebox = RuleBox.from_path(sample_rules_file)
+
+        texts = pa.array(["Hello world", None, "Any questions?"])
+        labels = rulebox.assign_labels_arrow(texts)
+        assert labels.to_pylist() == [["greeting"], [], ["question"]]
+
+        empty = rulebox.assign_labels_arrow(pa.array([], type=pa.string()))
+        assert len(empty) == 0
+
+    @pytest.mark.parametrize(
+        "build",
+        [
+            lambda pa, texts: pa.array(texts).slice(1),
+            lambda pa, texts: pa.chunked_array([texts[:2], texts[2:]]).slice(1),
+            lambda pa, texts: pa.array(texts, type=pa.large_string()).slice(1),
+        ],
+        ids=["sliced", "chunked", "large_string"],
+    )
+    def test_assign_labels_arrow_reads_arrow_buffers(self, sample_rules_file, build):
+        """Test pyarrow string buffers are read at the right offsets."""
+        pa = pytest.importorskip("pyarrow")
+        rulebox = RuleBox.from_path(sample_rules_file)
+
+        texts = build(pa, ["Goodbye", "Hello world", None, "Any questions?", "Hi"])
+        expected = [["greeting"], [], ["question"], ["greeting"]]
+        assert rulebox.assign_labels_arrow(texts).to_pylist() == expected
+        assert rulebox.assign_labels_vector(texts) == expected
+
 
 if __name__ == "__main__":
     pytest.main([__file__, "-v"])
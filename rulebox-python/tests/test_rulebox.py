@@ -3,174 +3,199 @@ Tests for the RuleBox Python bindings.
 """
 
 import json
-import tempfile
 import os
+import time
 from pathlib import Path
 import pytest
 from rulebox import RuleBox
 
 
-@pytest.fixture
-def simple_rules_file():
-    """Create a temporary rules file with simple test rules."""
-    rules = [
-        {
-            "label": "greeting",
-            "rule": {
-                "or_patterns": [
-                    {"pattern": "\\bhello\\b", "flags": ["i"]},
-                    {"pattern": "\\bhi\\b", "flags": ["i"]},
-                    {"pattern": "\\bhey\\b", "flags": ["i"]},
-                ]
-            },
+SIMPLE_RULES = [
+    {
+        "label": "greeting",
+        "rule": {
+            "or_patterns": [
+                {"pattern": "\\bhello\\b", "flags": ["i"]},
+                {"pattern": "\\bhi\\b", "flags": ["i"]},
+                {"pattern": "\\bhey\\b", "flags": ["i"]},
+            ]
         },
-        {"label": "question", "rule": {"and_patterns": [{"pattern": "\\?"}]}},
-        {
-            "label": "email",
-            "rule": {
-                "or_patterns": [
-                    {"pattern": "[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\\.[a-zA-Z]{2,}"}
-                ]
-            },
+    },
+    {"label": "question", "rule": {"and_patterns": [{"pattern": "\\?"}]}},
+    {
+        "label": "email",
+        "rule": {
+            "or_patterns": [
+                {"pattern": "[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\\.[a-zA-Z]{2,}"}
+            ]
         },
-    ]
-
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".json", delete=False) as f:
-        json.dump(rules, f, indent=2)
-        temp_file = f.name
-
-    yield temp_file
-
-    # Cleanup
-    try:
-        os.unlink(temp_file)
-    except FileNotFoundError:
-        pass
-
-
-@pytest.fixture
-def complex_rules_file():
-    """Create a temporary rules file with more complex rules."""
-    rules = [
-        {
-            "label": "urgent",
-            "rule": {
-                "and_patterns": [
-                    {"pattern": "urgent", "flags": ["i"]},
-                    {"pattern": "asap|immediately|now", "flags": ["i"]},
-                ]
-            },
+    },
+]
+
+COMPLEX_RULES = [
+    {
+        "label": "urgent",
+        "rule": {
+            "and_patterns": [
+                {"pattern": "urgent", "flags": ["i"]},
+                {"pattern": "asap|immediately|now", "flags": ["i"]},
+            ]
         },
-        {
-            "label": "polite",
-            "rule": {
-                "or_patterns": [
-                    {"pattern": "please", "flags": ["i"]},
-                    {"pattern": "thank you", "flags": ["i"]},
-                    {"pattern": "thanks", "flags": ["i"]},
-                ]
-            },
+    },
+    {
+        "label": "polite",
+        "rule": {
+            "or_patterns": [
+                {"pattern": "please", "flags": ["i"]},
+                {"pattern": "thank you", "flags": ["i"]},
+                {"pattern": "thanks", "flags": ["i"]},
+            ]
         },
-        {
-            "label": "not_spam",
-            "rule": {
-                "or_patterns": [{"pattern": "legitimate"}],
-                "not_patterns": [
-                    {"pattern": "click here", "flags": ["i"]},
-                    {"pattern": "free money", "flags": ["i"]},
-                ],
-            },
+    },
+    {
+        "label": "not_spam",
+        "rule": {
+            "or_patterns": [{"pattern": "legitimate"}],
+            "not_patterns": [
+                {"pattern": "click here", "flags": ["i"]},
+                {"pattern": "free money", "flags": ["i"]},
+            ],
         },
-    ]
+    },
+]
+
+
+# Serialized once, for the tests that load rules from JSON text
+SIMPLE_RULES_JSON = json.dumps(SIMPLE_RULES)
+COMPLEX_RULES_JSON = json.dumps(COMPLEX_RULES)
+
+
+@pytest.fixture(scope="module")
+def simple_rules_file(tmp_path_factory):
+    """A rules file with the simple test rules, for the from_path tests."""
+    rules_file = tmp_path_factory.mktemp("rules") / "simple_rules.json"
+    rules_file.write_text(SIMPLE_RULES_JSON)
+    return str(rules_file)
+
+
+@pytest.fixture(scope="module")
+def simple_rulebox():
+    """A RuleBox of the simple test rules, compiled once for the module."""
+    return RuleBox.from_json(SIMPLE_RULES_JSON)
+
+
+@pytest.fixture(scope="module")
+def simple_rulebox_from_path(simple_rules_file):
+    """The simple test rules loaded from their file, once for the module."""
+    return RuleBox.from_path(simple_rules_file)
+
+
+@pytest.fixture(scope="module")
+def simple_rulebox_from_cache(simple_rulebox, tmp_path_factory):
+    """The simple test rules loaded from a cache file, once for the module."""
+    cache_file = tmp_path_factory.mktemp("cache") / "simple_rules.cache"
+    simple_rulebox.to_cache(cache_file)
+    return RuleBox.from_cache(cache_file)
 
-    with tempfile.NamedTemporaryFile(mode="w", suffix=".json", delete=False) as f:
-        json.dump(rules, f, indent=2)
-        temp_file = f.name
 
-    yield temp_file
+@pytest.fixture(scope="module", autouse=True)
+def _warmup(simple_rulebox):
+    """Make the shared RuleBox's first match here, rather than in a test.
 
-    # Cleanup
-    try:
-        os.unlink(temp_file)
-    except FileNotFoundError:
-        pass
+    Matching builds the automata's states lazily, so the first texts a RuleBox
+    labels are slower than the rest.
+    """
+    simple_rulebox.assign_labels("warmup")
 
 
 class TestRuleBoxBasic:
     """Test basic RuleBox functionality."""
 
-    def test_from_path_success(self, simple_rules_file):
-        """Test successful loading from a valid rules file."""
-        rulebox = RuleBox.from_path(simple_rules_file)
-        assert isinstance(rulebox, RuleBox)
+    @pytest.mark.parametrize(
+        "path,exc,msg",
+        [
+            # A nonexistent file
+            ("/nonexistent/path/rules.json", OSError, "Failed to load RuleBox"),
+            # Neither string nor Path-like
+            (123, TypeError, "path must be a string or Path-like object"),
+            (None, TypeError, "path must be a string or Path-like object"),
+        ],
+    )
+    def test_from_path_errors(self, path, exc, msg):
+        """Test error handling for paths that can't be loaded."""
+        with pytest.raises(exc) as exc_info:
+            RuleBox.from_path(path)
+        assert msg in str(exc_info.value)
+
+    def test_from_path_invalid_json(self, tmp_path):
+        """Test error handling for invalid JSON."""
+        invalid_file = tmp_path / "rules.json"
+        invalid_file.write_text("invalid json content")
 
-    def test_from_path_nonexistent_file(self):
-        """Test error handling for nonexistent file."""
         with pytest.raises(Exception) as exc_info:
-            RuleBox.from_path("/nonexistent/path/rules.json")
+            RuleBox.from_path(invalid_file)
         assert "Failed to load RuleBox" in str(exc_info.value)
 
-    def test_from_path_invalid_json(self):
-        """Test error handling for invalid JSON."""
-        with tempfile.NamedTemporaryFile(mode="w", suffix=".json", delete=False) as f:
-            f.write("invalid json content")
-            invalid_file = f.name
-
-        try:
-            with pytest.raises(Exception) as exc_info:
-                RuleBox.from_path(invalid_file)
-            assert "Failed to load RuleBox" in str(exc_info.value)
-        finally:
-            os.unlink(invalid_file)
-
-    def test_from_path_with_string(self, simple_rules_file):
-        """Test from_path works with string paths."""
-        # simple_rules_file is already a string path
-        rulebox = RuleBox.from_path(simple_rules_file)
+    @pytest.mark.parametrize("path_type", [str, Path])
+    def test_from_path_accepts_path_types(self, simple_rules_file, path_type):
+        """Test from_path works with string paths and pathlib.Path objects."""
+        rulebox = RuleBox.from_path(path_type(simple_rules_file))
         assert isinstance(rulebox, RuleBox)
 
-        # Verify it actually works by testing a simple case
-        labels = rulebox.assign_labels("Hello world")
-        assert "greeting" in labels
-
-    def test_from_path_with_pathlib_path(self, simple_rules_file):
-        """Test from_path works with pathlib.Path objects."""
+    def test_from_path_hot_loop(self, simple_rules_file):
+        """Test that reloading an unchanged file is cheap, string path or not."""
+        from_path = RuleBox.from_path
         path_obj = Path(simple_rules_file)
-        rulebox = RuleBox.from_path(path_obj)
-        assert isinstance(rulebox, RuleBox)
+        start = time.perf_counter()
+        for _ in range(10_000):
+            from_path(simple_rules_file)
+            from_path(path_obj)
+        # A generous budget: cached loads take microseconds, compiling far longer
+        assert time.perf_counter() - start < 10
+
+    def test_from_path_reloads_modified_file(self, tmp_path):
+        """Test that the from_path cache notices when the rules file changes."""
+        # Its own file, as the shared rules file must stay as it is
+        rules_file = tmp_path / "rules.json"
+        rules_file.write_text(SIMPLE_RULES_JSON)
+        assert "greeting" in RuleBox.from_path(rules_file).assign_labels("Hi")
+
+        with open(rules_file, "w") as f:
+            json.dump(
+                [{"label": "changed", "rule": {"or_patterns": [{"pattern": "Hi"}]}}], f
+            )
+        stat = os.stat(rules_file)
+        os.utime(rules_file, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10**9))
 
-        # Verify it actually works by testing a simple case
-        labels = rulebox.assign_labels("Hello world")
-        assert "greeting" in labels
+        assert RuleBox.from_path(rules_file).assign_labels("Hi") == ["changed"]
 
-    def test_from_path_invalid_type(self):
-        """Test from_path raises appropriate error for invalid types."""
-        with pytest.raises(TypeError) as exc_info:
-            RuleBox.from_path(123)  # Neither string nor Path-like
-        assert "path must be a string or Path-like object" in str(exc_info.value)
+    def test_clear_cache(self, simple_rules_file):
+        """Test that clearing the cache doesn't affect loaded RuleBoxes."""
+        rulebox = RuleBox.from_path(simple_rules_file)
+        RuleBox.clear_cache()
 
-        with pytest.raises(TypeError) as exc_info:
-            RuleBox.from_path(None)
-        assert "path must be a string or Path-like object" in str(exc_info.value)
+        assert "greeting" in rulebox.assign_labels("Hello world")
+        assert "greeting" in RuleBox.from_path(simple_rules_file).assign_labels("Hi")
+
+    def test_from_cache_matches_from_path(self, simple_rulebox, tmp_path):
+        """Test that a RuleBox loaded from a cache file labels texts the same."""
+        cache_file = tmp_path / "rules.cache"
+        simple_rulebox.to_cache(cache_file)
+
+        cached = RuleBox.from_cache(cache_file)
+        texts = ["Hello world", "Goodbye", "Héllo wörld, hi there", "nothing"]
+        expected = simple_rulebox.assign_labels_vector(texts)
+        assert cached.assign_labels_vector(texts) == expected
+
+    def test_from_cache_invalid_file(self, simple_rules_file):
+        """Test error handling for files that aren't caches."""
+        with pytest.raises(OSError) as exc_info:
+            RuleBox.from_cache(simple_rules_file)
+        assert "Failed to load RuleBox cache" in str(exc_info.value)
 
     def test_from_json_success(self):
         """Test successful loading from a JSON string."""
-        rules_json = json.dumps(
-            [
-                {
-                    "label": "greeting",
-                    "rule": {
-                        "or_patterns": [
-                            {"pattern": "\\bhello\\b", "flags": ["i"]},
-                            {"pattern": "\\bhi\\b", "flags": ["i"]},
-                        ]
-                    },
-                },
-                {"label": "question", "rule": {"and_patterns": [{"pattern": "\\?"}]}},
-            ]
-        )
-
-        rulebox = RuleBox.from_json(rules_json)
+        rulebox = RuleBox.from_json(SIMPLE_RULES_JSON)
         assert isinstance(rulebox, RuleBox)
 
         # Verify it actually works by testing functionality
@@ -188,112 +213,77 @@ class TestRuleBoxBasic:
 
     def test_from_json_empty_rules(self):
         """Test loading from empty rules array."""
-        rules_json = json.dumps([])
-
-        rulebox = RuleBox.from_json(rules_json)
+        rulebox = RuleBox.from_json("[]")
         assert isinstance(rulebox, RuleBox)
 
         # Should return no labels for any text
         labels = rulebox.assign_labels("Hello world")
-        assert len(labels) == 0
+        assert not labels
 
-    def test_from_json_vs_from_path_equivalence(self, simple_rules_file):
+    def test_from_json_vs_from_path_equivalence(
+        self, simple_rulebox, simple_rulebox_from_path
+    ):
         """Test that from_json and from_path produce equivalent results."""
-        # Load from file
-        rulebox_from_path = RuleBox.from_path(simple_rules_file)
-
-        # Load the same rules from JSON string
-        with open(simple_rules_file, "r") as f:
-            rules_json = f.read()
-        rulebox_from_json = RuleBox.from_json(rules_json)
-
-        # Test that both produce the same results
-        test_texts = [
+        texts = [
             "Hello world",
             "What's your email?",
             "Contact me at test@example.com",
             "Plain text with no matches",
         ]
-
-        for text in test_texts:
-            labels_from_path = set(rulebox_from_path.assign_labels(text))
-            labels_from_json = set(rulebox_from_json.assign_labels(text))
-            assert labels_from_path == labels_from_json, (
-                f"Results differ for text: '{text}'"
-            )
+        # pytest's assertion diff points at the first text whose labels differ
+        from_path = simple_rulebox_from_path.assign_labels_vector(texts)
+        from_json = simple_rulebox.assign_labels_vector(texts)
+        assert [set(labels) for labels in from_path] == [
+            set(labels) for labels in from_json
+        ]
 
 
 class TestAssignLabels:
     """Test the assign_labels method."""
 
-    def test_assign_labels_single_match(self, simple_rules_file):
+    def test_assign_labels_single_match(self, simple_rulebox):
         """Test assigning labels to text with a single match."""
-        rulebox = RuleBox.from_path(simple_rules_file)
+        labels = simple_rulebox.assign_labels("Hello world")
+        assert labels == ["greeting"]
 
-        labels = rulebox.assign_labels("Hello world")
-        assert "greeting" in labels
-        assert len(labels) == 1
-
-    def test_assign_labels_multiple_matches(self, simple_rules_file):
+    def test_assign_labels_multiple_matches(self, simple_rulebox):
         """Test assigning labels to text with multiple matches."""
-        rulebox = RuleBox.from_path(simple_rules_file)
-
-        labels = rulebox.assign_labels(
+        labels = simple_rulebox.assign_labels(
             "Hello! How are you? Contact me at test@example.com"
         )
-        assert "greeting" in labels
-        assert "question" in labels
-        assert "email" in labels
-        assert len(labels) == 3
+        assert set(labels) == {"greeting", "question", "email"}
 
-    def test_assign_labels_no_match(self, simple_rules_file):
+    def test_assign_labels_no_match(self, simple_rulebox):
         """Test assigning labels to text with no matches."""
-        rulebox = RuleBox.from_path(simple_rules_file)
-
-        labels = rulebox.assign_labels("This is plain text with no matches.")
-        assert len(labels) == 0
+        labels = simple_rulebox.assign_labels("This is plain text with no matches.")
+        assert not labels
 
-    def test_assign_labels_case_insensitive(self, simple_rules_file):
+    def test_assign_labels_case_insensitive(self, simple_rulebox):
         """Test case insensitive matching."""
-        rulebox = RuleBox.from_path(simple_rules_file)
-
-        labels = rulebox.assign_labels("HELLO WORLD")
-        assert "greeting" in labels
-
-        labels = rulebox.assign_labels("hi there")
-        assert "greeting" in labels
-
-        labels = rulebox.assign_labels("HEY BUDDY")
-        assert "greeting" in labels
+        results = simple_rulebox.assign_labels_vector(
+            ["HELLO WORLD", "hi there", "HEY BUDDY"]
+        )
+        assert all("greeting" in labels for labels in results)
 
-    def test_assign_labels_word_boundaries(self, simple_rules_file):
+    def test_assign_labels_word_boundaries(self, simple_rulebox):
         """Test that word boundaries work correctly."""
-        rulebox = RuleBox.from_path(simple_rules_file)
-
-        # Should match
-        labels = rulebox.assign_labels("Hi there")
-        assert "greeting" in labels
-
-        # Should NOT match (hi is part of "This")
-        labels = rulebox.assign_labels("This is a test")
-        assert "greeting" not in labels
+        # The second should NOT match (hi is part of "This")
+        results = simple_rulebox.assign_labels_vector(["Hi there", "This is a test"])
+        assert "greeting" in results[0]
+        assert "greeting" not in results[1]
 
-    def test_assign_labels_returns_list(self, simple_rules_file):
+    def test_assign_labels_returns_list(self, simple_rulebox):
         """Test that assign_labels returns a list."""
-        rulebox = RuleBox.from_path(simple_rules_file)
-
-        labels = rulebox.assign_labels("Hello world")
-        assert isinstance(labels, list)
-        assert all(isinstance(label, str) for label in labels)
+        labels = simple_rulebox.assign_labels("Hello world")
+        assert type(labels) is list
+        assert not labels or type(labels[0]) is str
 
 
 class TestAssignLabelsVector:
     """Test the assign_labels_vector method."""
 
-    def test_assign_labels_vector_basic(self, simple_rules_file):
+    def test_assign_labels_vector_basic(self, simple_rulebox):
         """Test basic vector labeling functionality."""
-        rulebox = RuleBox.from_path(simple_rules_file)
-
         texts = [
             "Hello world",
             "What's your email?",
@@ -301,7 +291,7 @@ class TestAssignLabelsVector:
             "Plain text",
         ]
 
-        all_labels = rulebox.assign_labels_vector(texts)
+        all_labels = simple_rulebox.assign_labels_vector(texts)
 
         assert len(all_labels) == 4
         assert isinstance(all_labels, list)
@@ -311,98 +301,143 @@ class TestAssignLabelsVector:
         assert "greeting" in all_labels[0]
         assert "question" in all_labels[1]
         assert "email" in all_labels[2]
-        assert len(all_labels[3]) == 0
+        assert not all_labels[3]
+
+    # Only a RuleBox loaded from a cache scans texts several at a time
+    @pytest.mark.parametrize("loader", ["simple_rulebox", "simple_rulebox_from_cache"])
+    @pytest.mark.parametrize("n", [4, 64, 1024])
+    def test_assign_labels_vector_scales(self, request, loader, n):
+        """Test batches big enough to be labelled on several threads."""
+        rulebox = request.getfixturevalue(loader)
+        texts = [
+            "Hello world",
+            "What's your email?",
+            "Contact me at test@example.com",
+            "Plain text",
+        ] * (n // 4)
+        expected = [["greeting"], ["question"], ["email"], []]
 
-    def test_assign_labels_vector_empty_input(self, simple_rules_file):
-        """Test vector labeling with empty input."""
-        rulebox = RuleBox.from_path(simple_rules_file)
+        all_labels = rulebox.assign_labels_vector(texts)
+        assert len(all_labels) == n
+        assert all_labels[:4] == expected
+        assert all_labels[n // 2 : n // 2 + 4] == expected
+        assert all_labels[-4:] == expected
 
-        all_labels = rulebox.assign_labels_vector([])
+    def test_assign_labels_vector_empty_input(self, simple_rulebox):
+        """Test vector labeling with empty input."""
+        all_labels = simple_rulebox.assign_labels_vector([])
         assert all_labels == []
 
-    def test_assign_labels_vector_single_text(self, simple_rules_file):
+    def test_assign_labels_vector_single_text(self, simple_rulebox):
         """Test vector labeling with single text."""
-        rulebox = RuleBox.from_path(simple_rules_file)
-
-        all_labels = rulebox.assign_labels_vector(["Hello world"])
+        all_labels = simple_rulebox.assign_labels_vector(["Hello world"])
         assert len(all_labels) == 1
         assert "greeting" in all_labels[0]
 
+    def test_assign_labels_vector_parallel_matches_serial(self, simple_rulebox):
+        """Test that multi-threaded labelling gives the same results in order."""
+        texts = ["Hello world", "What's your email?", "test@example.com", "Plain"]
+        texts = texts * 250
 
-class TestComplexRules:
-    """Test more complex rule patterns."""
+        parallel = simple_rulebox.assign_labels_vector(texts, parallel=True)
+        serial = simple_rulebox.assign_labels_vector(texts, parallel=False)
+        assert parallel == serial
+        assert len(parallel) == 1000
 
-    def test_and_patterns(self, complex_rules_file):
-        """Test AND pattern matching."""
-        rulebox = RuleBox.from_path(complex_rules_file)
+    def test_assign_labels_vector_accepts_iterables(self, simple_rulebox):
+        """Test vector labeling with tuples and generators as well as lists."""
+        texts = ("Hello world", "What's your email?")
+        expected = [["greeting"], ["question"]]
 
-        # Should match (has both "urgent" and "asap")
-        labels = rulebox.assign_labels("This is urgent, please do it ASAP!")
-        assert "urgent" in labels
+        assert simple_rulebox.assign_labels_vector(texts) == expected
+        assert simple_rulebox.assign_labels_vector(t for t in texts) == expected
 
-        # Should NOT match (has "urgent" but not the second pattern)
-        labels = rulebox.assign_labels("This is urgent but not time-sensitive")
-        assert "urgent" not in labels
+    def test_assign_labels_vector_missing_values(self, simple_rulebox):
+        """Test that None and NaN are labelled as empty text."""
+        all_labels = simple_rulebox.assign_labels_vector(
+            [None, "Hello world", float("nan")]
+        )
+        assert all_labels == [[], ["greeting"], []]
 
-    def test_not_patterns(self, complex_rules_file):
-        """Test NOT pattern matching."""
-        rulebox = RuleBox.from_path(complex_rules_file)
+        with pytest.raises(TypeError):
+            simple_rulebox.assign_labels_vector(["Hello world", 123])
 
-        # Should match (has "legitimate" and no excluded patterns)
-        labels = rulebox.assign_labels("This is a legitimate request")
-        assert "not_spam" in labels
+    def test_assign_labels_vector_rejects_single_string(self, simple_rulebox):
+        """Test that a bare string is not labelled character by character."""
+        with pytest.raises(TypeError) as exc_info:
+            simple_rulebox.assign_labels_vector("Hello world")
+        assert "not a single string" in str(exc_info.value)
 
-        # Should NOT match (has excluded pattern)
-        labels = rulebox.assign_labels(
-            "This is legitimate but click here for free money"
-        )
-        assert "not_spam" not in labels
 
-    def test_mixed_patterns(self, complex_rules_file):
-        """Test text that matches multiple complex rules."""
-        rulebox = RuleBox.from_path(complex_rules_file)
+class TestComplexRules:
+    """Test more complex rule patterns."""
 
-        text = "Please make this urgent change immediately, thanks!"
-        labels = rulebox.assign_labels(text)
+    @pytest.fixture(scope="class")
+    def complex_rulebox(self):
+        """A RuleBox of the complex test rules, compiled once for the class."""
+        rulebox = RuleBox.from_json(COMPLEX_RULES_JSON)
+        # Make its first (slower) match here, as _warmup does for simple_rulebox
+        rulebox.assign_labels("warmup")
+        return rulebox
+
+    def test_complex_rules_matrix(self, complex_rulebox):
+        """Test AND, NOT and mixed pattern matching in one batch."""
+        results = complex_rulebox.assign_labels_vector(
+            [
+                # Has both "urgent" and "asap"
+                "This is urgent, please do it ASAP!",
+                # Has "urgent" but not the second AND pattern
+                "This is urgent but not time-sensitive",
+                # Has "legitimate" and no excluded patterns
+                "This is a legitimate request",
+                # Has "legitimate" but also an excluded pattern
+                "This is legitimate but click here for free money",
+                # "urgent" and "immediately" make it urgent; "please" and
+                # "thanks" polite
+                "Please make this urgent change immediately, thanks!",
+            ]
+        )
 
-        assert "urgent" in labels  # has "urgent" and "immediately"
-        assert "polite" in labels  # has "please" and "thanks"
+        assert "urgent" in results[0]
+        assert "urgent" not in results[1]
+        assert "not_spam" in results[2]
+        assert "not_spam" not in results[3]
+        assert set(results[4]) == {"urgent", "polite"}
 
 
 class TestEdgeCases:
     """Test edge cases and error conditions."""
 
-    def test_empty_text(self, simple_rules_file):
+    def test_empty_text(self, simple_rulebox):
         """Test labeling empty text."""
-        rulebox = RuleBox.from_path(simple_rules_file)
-
-        labels = rulebox.assign_labels("")
-        assert len(labels) == 0
+        labels = simple_rulebox.assign_labels("")
+        assert not labels
 
-    def test_unicode_text(self, simple_rules_file):
+    def test_unicode_text(self, simple_rulebox):
         """Test labeling text with unicode characters."""
-        rulebox = RuleBox.from_path(simple_rules_file)
-
-        labels = rulebox.assign_labels("Hello 世界! Email: test@例え.com")
-        assert "greeting" in labels
+        results = simple_rulebox.assign_labels_vector(
+            ["Hello 世界! Email: test@例え.com", "你好世界"]
+        )
+        assert "greeting" in results[0]
         # Note: The email pattern might not match unicode domains
-
-    def test_very_long_text(self, simple_rules_file):
-        """Test labeling very long text."""
-        rulebox = RuleBox.from_path(simple_rules_file)
-
-        long_text = "Hello " + "word " * 1000 + "test@example.com"
-        labels = rulebox.assign_labels(long_text)
-        assert "greeting" in labels
-        assert "email" in labels
-
-    def test_special_characters(self, simple_rules_file):
+        assert results[1] == []
+
+    @pytest.mark.parametrize(
+        "n_words", [64, 4096, pytest.param(1_000_000, marks=pytest.mark.slow)]
+    )
+    def test_very_long_text(self, simple_rulebox, n_words):
+        """Test labeling very long text, with matches at either end."""
+        text = "Hello " + "word " * n_words + "test@example.com"
+        labels = simple_rulebox.assign_labels(text)
+        assert set(labels) == {"greeting", "email"}
+
+    def test_special_characters(self, simple_rulebox):
         """Test text with special regex characters."""
-        rulebox = RuleBox.from_path(simple_rules_file)
-
         # These should not cause regex errors
-        labels = rulebox.assign_labels("Hello [world] (test) {hello} ^start$ .any*")
-        assert "greeting" in labels
+        results = simple_rulebox.assign_labels_vector(
+            ["Hello [world] (test) {hello} ^start$ .any*", "[hi]", "(hey) .*+"]
+        )
+        assert all("greeting" in labels for labels in results)
 
 
 if __name__ == "__main__":
@@ -67,7 +67,7 @@ fn create_test_rulebox() -> RuleBox {
         },
     ];
 
-    let mut rulebox = RuleBox(rules);
+    let mut rulebox = RuleBox::new(rules);
     rulebox.compile().expect("Failed to compile rules");
     rulebox
 }
@@ -0,0 +1,81 @@
+use regex_automata::dfa::dense::DFA;
+use std::error::Error;
+use std::fs;
+
+const MAGIC: &[u8; 8] = b"RULEBOX\0";
+const VERSION: &str = env!("CARGO_PKG_VERSION");
+
+/// Writes the file behind `RuleBox::to_cache`: the rules as JSON, followed by
+/// the matcher's fully determinized pattern sets (one per haystack, empty if it
+/// has none or it was too large to build).
+///
+/// Every section is a little-endian `u64` length followed by its bytes. The
+/// DFAs are stored in native byte order, so a cache only loads on machines of
+/// the same endianness and rulebox version that wrote it.
+pub fn write(path: &str, rules: &[u8], dfas: &[Option<DFA<Vec<u32>>>; 2]) -> std::io::Result<()> {
+    let mut out = MAGIC.to_vec();
+    write_section(&mut out, VERSION.as_bytes());
+    write_section(&mut out, &[cfg!(target_endian = "little") as u8]);
+    write_section(&mut out, rules);
+    for dfa in dfas {
+        match dfa {
+            Some(dfa) => {
+                let (bytes, padding) = dfa.to_bytes_native_endian();
+                write_section(&mut out, &bytes[padding..]);
+            }
+            None => write_section(&mut out, &[]),
+        }
+    }
+    fs::write(path, out)
+}
+
+/// The rules JSON and DFAs from a file written by `write`
+pub fn read(path: &str) -> Result<(Vec<u8>, [Option<DFA<Vec<u32>>>; 2]), Box<dyn Error>> {
+    let bytes = fs::read(path)?;
+    let mut rest = bytes
+        .strip_prefix(MAGIC.as_slice())
+        .ok_or("Not a rulebox cache file")?;
+    let version = read_section(&mut rest)?;
+    let little_endian = read_section(&mut rest)?;
+    if version != VERSION.as_bytes() || little_endian != [cfg!(target_endian = "little") as u8] {
+        return Err(format!(
+            "Cache was written by a different rulebox build (this is {})",
+            VERSION
+        )
+        .into());
+    }
+    let rules = read_section(&mut rest)?.to_vec();
+    let text_dfa = read_dfa(read_section(&mut rest)?)?;
+    let folded_dfa = read_dfa(read_section(&mut rest)?)?;
+    Ok((rules, [text_dfa, folded_dfa]))
+}
+
+fn write_section(out: &mut Vec<u8>, section: &[u8]) {
+    out.extend_from_slice(&(section.len() as u64).to_le_bytes());
+    out.extend_from_slice(section);
+}
+
+fn read_section<'a>(rest: &mut &'a [u8]) -> Result<&'a [u8], Box<dyn Error>> {
+    let truncated = || "Cache file is truncated";
+    let (len, tail) = rest.split_first_chunk::<8>().ok_or_else(truncated)?;
+    let len = usize::try_from(u64::from_le_bytes(*len))?;
+    if tail.len() < len {
+        return Err(truncated().into());
+    }
+    let (section, tail) = tail.split_at(len);
+    *rest = tail;
+    Ok(section)
+}
+
+fn read_dfa(bytes: &[u8]) -> Result<Option<DFA<Vec<u32>>>, Box<dyn Error>> {
+    if bytes.is_empty() {
+        return Ok(None);
+    }
+    // Deserializing needs the bytes aligned as u32s, which the section's
+    // position in the file doesn't guarantee
+    let mut aligned = vec![0; bytes.len() + 3];
+    let start = aligned.as_ptr().align_offset(4);
+    aligned[start..start + bytes.len()].copy_from_slice(bytes);
+    let (dfa, _) = DFA::from_bytes(&aligned[start..])?;
+    Ok(Some(dfa.to_owned()))
+}
@@ -0,0 +1,117 @@
+use regex_syntax::hir::{
+    Capture, Class, ClassUnicode, ClassUnicodeRange, Hir, HirKind, Look, Repetition,
+};
+use std::sync::OnceLock;
+
+/// Rewrites a case-insensitive pattern into a case-sensitive one that matches
+/// the same texts once they have been through `fold_text`.
+///
+/// `fold_text` replaces each character with another from its case-folding
+/// class, so a class closed under case folding (as every class of a `(?i)`
+/// pattern is) contains a character exactly when it contains the folded one,
+/// and can drop the characters folding never produces: `(?i)budget` becomes
+/// the literal `budget`. Returns `None` if the pattern has anything that isn't
+/// closed under case folding, or if folding would change nothing.
+pub fn fold_case(hir: &Hir) -> Option<Hir> {
+    let folded = fold_hir(hir)?;
+    (folded != *hir).then_some(folded)
+}
+
+/// Writes `text` to `out` with ASCII letters lowercased, and the two non-ASCII
+/// characters that case-fold to ASCII letters (KELVIN SIGN and LATIN SMALL
+/// LETTER LONG S) replaced by them
+pub fn fold_text(text: &str, out: &mut String) {
+    out.clear();
+    if text.is_ascii() {
+        out.push_str(text);
+        out.make_ascii_lowercase();
+        return;
+    }
+    out.extend(text.chars().map(|ch| match ch {
+        '\u{212A}' => 'k',
+        '\u{017F}' => 's',
+        _ => ch.to_ascii_lowercase(),
+    }));
+}
+
+fn fold_hir(hir: &Hir) -> Option<Hir> {
+    Some(match hir.kind() {
+        HirKind::Empty => hir.clone(),
+        HirKind::Literal(literal) => {
+            // Only caseless characters, which fold_text leaves alone
+            let text = std::str::from_utf8(&literal.0).ok()?;
+            if !text.chars().all(|ch| case_closed(&char_class(ch))) {
+                return None;
+            }
+            hir.clone()
+        }
+        HirKind::Class(Class::Unicode(class)) => {
+            if !case_closed(class) {
+                return None;
+            }
+            let mut class = class.clone();
+            class.intersect(folded_chars());
+            Hir::class(Class::Unicode(class))
+        }
+        HirKind::Class(Class::Bytes(_)) => return None,
+        HirKind::Look(look) => {
+            // ASCII word boundaries would see KELVIN SIGN and its folded `k`
+            // differently; the Unicode ones treat both as word characters
+            let unicode_safe = matches!(
+                look,
+                Look::Start
+                    | Look::End
+                    | Look::StartLF
+                    | Look::EndLF
+                    | Look::StartCRLF
+                    | Look::EndCRLF
+                    | Look::WordUnicode
+                    | Look::WordUnicodeNegate
+                    | Look::WordStartUnicode
+                    | Look::WordEndUnicode
+                    | Look::WordStartHalfUnicode
+                    | Look::WordEndHalfUnicode
+            );
+            if !unicode_safe {
+                return None;
+            }
+            hir.clone()
+        }
+        HirKind::Repetition(repetition) => Hir::repetition(Repetition {
+            sub: Box::new(fold_hir(&repetition.sub)?),
+            ..repetition.clone()
+        }),
+        HirKind::Capture(capture) => Hir::capture(Capture {
+            sub: Box::new(fold_hir(&capture.sub)?),
+            ..capture.clone()
+        }),
+        HirKind::Concat(subs) => Hir::concat(subs.iter().map(fold_hir).collect::<Option<_>>()?),
+        HirKind::Alternation(subs) => {
+            Hir::alternation(subs.iter().map(fold_hir).collect::<Option<_>>()?)
+        }
+    })
+}
+
+fn case_closed(class: &ClassUnicode) -> bool {
+    let mut folded = class.clone();
+    folded.case_fold_simple();
+    folded == *class
+}
+
+fn char_class(ch: char) -> ClassUnicode {
+    ClassUnicode::new([ClassUnicodeRange::new(ch, ch)])
+}
+
+// Every character fold_text can output
+fn folded_chars() -> &'static ClassUnicode {
+    static FOLDED: OnceLock<ClassUnicode> = OnceLock::new();
+    FOLDED.get_or_init(|| {
+        let mut class = ClassUnicode::new([
+            ClassUnicodeRange::new('A', 'Z'),
+            ClassUnicodeRange::new('\u{017F}', '\u{017F}'),
+            ClassUnicodeRange::new('\u{212A}', '\u{212A}'),
+        ]);
+        class.negate();
+        class
+    })
+}
@@ -1,9 +1,26 @@
+mod cache;
+mod fold;
+mod matcher;
+mod prefilter;
+
+use matcher::Matcher;
+#[cfg(feature = "parallel")]
+use matcher::LANES;
+#[cfg(feature = "parallel")]
+use rayon::prelude::*;
 use regex::{Regex as RustRegex, RegexBuilder};
+use regex_syntax::hir::Hir;
+use regex_syntax::ParserBuilder;
 use serde::{Deserialize, Serialize};
-use std::collections::HashSet;
+use std::collections::{HashMap, HashSet};
 use std::fs;
+use std::sync::{Arc, OnceLock};
 use uuid::Uuid;
 
+// Batches smaller than this are labelled on the calling thread
+#[cfg(feature = "parallel")]
+const PARALLEL_THRESHOLD: usize = 64;
+
 // Represents a regex pattern and flags
 #[derive(Debug, Serialize, Deserialize)]
 pub struct RegexRule {
@@ -12,30 +29,105 @@ pub struct RegexRule {
     pub flags: Vec<String>,
 
     #[serde(skip)]
-    pub compiled: Option<RustRegex>,
+    pub compiled: Option<LazyRegex>,
+}
+
+/// A pattern's own regex, built the first time it is used. A RuleBox labels
+/// texts with its combined matcher, so most of these are never built at all.
+/// Clones share the built regex.
+#[derive(Debug, Clone)]
+pub struct LazyRegex(Arc<LazyRegexInner>);
+
+#[derive(Debug)]
+struct LazyRegexInner {
+    // The parsed pattern, flags applied, which the combined matcher is built from
+    hir: Hir,
+    builder: RegexBuilder,
+    regex: OnceLock<Option<RustRegex>>,
 }
 
+impl LazyRegex {
+    fn new(hir: Hir, builder: RegexBuilder) -> Self {
+        Self(Arc::new(LazyRegexInner {
+            hir,
+            builder,
+            regex: OnceLock::new(),
+        }))
+    }
+
+    /// The regex, or `None` if it is too large to build
+    pub fn get(&self) -> Option<&RustRegex> {
+        let inner = &*self.0;
+        inner
+            .regex
+            .get_or_init(|| inner.builder.build().ok())
+            .as_ref()
+    }
+
+    fn hir(&self) -> &Hir {
+        &self.0.hir
+    }
+}
+
+// Regexes already compiled for a ruleset, by pattern and flags (see
+// RegexRule::key), so rules repeating a pattern share one copy.
+type RegexCache = HashMap<(String, Vec<String>), LazyRegex>;
+
 impl RegexRule {
     pub fn compile(&mut self) -> Result<(), String> {
+        self.compile_cached(&mut RegexCache::new())
+    }
+
+    fn compile_cached(&mut self, cache: &mut RegexCache) -> Result<(), String> {
+        let key = self.key();
+        if let Some(re) = cache.get(&key) {
+            self.compiled = Some(re.clone());
+            return Ok(());
+        }
+
         let mut builder = RegexBuilder::new(&self.pattern);
+        let mut parser = ParserBuilder::new();
         for flag in &self.flags {
             match flag.as_str() {
-                "i" => builder.case_insensitive(true),
-                "m" => builder.multi_line(true),
+                "i" => {
+                    builder.case_insensitive(true);
+                    parser.case_insensitive(true);
+                }
+                "m" => {
+                    builder.multi_line(true);
+                    parser.multi_line(true);
+                }
                 _ => return Err(format!("Unknown regex flag: {}", flag)),
             };
         }
-        match builder.build() {
-            Ok(re) => {
-                self.compiled = Some(re);
+        // Only parse the pattern here; the regex itself is built on first use
+        match parser.build().parse(&self.pattern) {
+            Ok(hir) => {
+                let re = LazyRegex::new(hir, builder);
+                self.compiled = Some(re.clone());
+                cache.insert(key, re);
                 Ok(())
             }
             Err(e) => Err(format!("Invalid regex '{}': {}", self.pattern, e)),
         }
     }
 
+    // The pattern and its flags, sorted and without repeats, which together
+    // decide what it matches
+    fn key(&self) -> (String, Vec<String>) {
+        let mut flags = self.flags.clone();
+        flags.sort_unstable();
+        flags.dedup();
+        (self.pattern.clone(), flags)
+    }
+
+    // The parsed pattern, once compiled
+    fn hir(&self) -> Option<&Hir> {
+        self.compiled.as_ref().map(LazyRegex::hir)
+    }
+
     pub fn check(&self, text: &str) -> bool {
-        match &self.compiled {
+        match self.compiled.as_ref().and_then(LazyRegex::get) {
             Some(re) => re.is_match(text),
             None => false,
         }
@@ -54,14 +146,18 @@ pub struct Rule {
 
 impl Rule {
     pub fn compile(&mut self) -> Result<(), String> {
+        self.compile_cached(&mut RegexCache::new())
+    }
+
+    fn compile_cached(&mut self, cache: &mut RegexCache) -> Result<(), String> {
         for p in &mut self.and_patterns {
-            p.compile()?;
+            p.compile_cached(cache)?;
         }
         for p in &mut self.or_patterns {
-            p.compile()?;
+            p.compile_cached(cache)?;
         }
         for p in &mut self.not_patterns {
-            p.compile()?;
+            p.compile_cached(cache)?;
         }
 
         if !self.and_patterns.is_empty() && !self.or_patterns.is_empty() {
@@ -143,9 +239,22 @@ impl LabeledText {
 }
 
 #[derive(Debug, Serialize, Deserialize)]
-pub struct RuleBox(pub Vec<LabelRule>);
+#[serde(transparent)]
+pub struct RuleBox {
+    pub rules: Vec<LabelRule>,
+
+    #[serde(skip)]
+    matcher: Option<Matcher>,
+}
 
 impl RuleBox {
+    pub fn new(rules: Vec<LabelRule>) -> Self {
+        Self {
+            rules,
+            matcher: None,
+        }
+    }
+
     pub fn from_json(json: &str) -> Result<Self, Box<dyn std::error::Error>> {
         let mut rulebox: RuleBox = serde_json::from_str(json)?;
         rulebox.compile()?;
@@ -153,49 +262,250 @@ impl RuleBox {
     }
 
     pub fn from_path(path: &str) -> Result<Self, Box<dyn std::error::Error>> {
-        let json = fs::read_to_string(path)?;
-        Self::from_json(&json)
+        let mut json = fs::read(path)?;
+        let mut rulebox = parse_rules(&mut json)?;
+        rulebox.compile()?;
+        Ok(rulebox)
+    }
+
+    /// Save the rules together with their fully determinized matcher, so that
+    /// `from_cache` can skip the slowest part of compiling them. The cache only
+    /// loads with the same rulebox version on a machine of the same endianness.
+    pub fn to_cache(&self, path: &str) -> Result<(), Box<dyn std::error::Error>> {
+        let matcher = self
+            .matcher
+            .as_ref()
+            .ok_or("RuleBox must be compiled before it can be cached")?;
+        let rules = serde_json::to_vec(self)?;
+        cache::write(path, &rules, &matcher.build_dfas())?;
+        Ok(())
     }
 
+    /// Load the rules and matcher saved by `to_cache`. Each rule's patterns are
+    /// checked but not compiled, and the matcher's DFAs are used as they are.
+    pub fn from_cache(path: &str) -> Result<Self, Box<dyn std::error::Error>> {
+        let (mut json, dfas) = cache::read(path)?;
+        let mut rulebox = parse_rules(&mut json)?;
+        rulebox.compile_rules()?;
+        rulebox.matcher = Some(Matcher::with_dfas(&rulebox.rules, dfas)?);
+        Ok(rulebox)
+    }
+
+    /// Compile every rule, then combine all active patterns into a single matcher.
+    /// Must be called again if `rules` is modified afterwards.
     pub fn compile(&mut self) -> Result<(), String> {
-        for rule in &mut self.0 {
-            rule.compile()?;
+        self.compile_rules()?;
+        self.matcher = Some(Matcher::new(&self.rules)?);
+        Ok(())
+    }
+
+    // Check and compile every rule, without the matcher
+    fn compile_rules(&mut self) -> Result<(), String> {
+        let mut cache = RegexCache::new();
+        for rule in &mut self.rules {
+            rule.rule.compile_cached(&mut cache)?;
         }
         Ok(())
     }
 
     pub fn check(&self, text: &str) -> LabeledText {
         let mut labeled = LabeledText::new(text.to_string());
-        for rule in &self.0 {
-            rule.check(&mut labeled);
-        }
+        labeled.labels.extend(self.unique_labels(text));
         labeled
     }
 
-    pub fn check_many(&self, texts: &[String]) -> Vec<HashSet<String>> {
-        texts.iter().map(|t| self.check(t).labels).collect()
+    pub fn check_many<S: AsRef<str>>(&self, texts: &[S]) -> Vec<HashSet<String>> {
+        texts
+            .iter()
+            .map(|t| self.check(t.as_ref()).labels)
+            .collect()
     }
 
     pub fn assign_labels(&self, text: &str) -> Vec<String> {
-        let labels = self.check(text).labels;
-        labels.into_iter().collect()
+        self.unique_labels(text)
+    }
+
+    /// Accepts any slice of string-likes (`String`, `&str`, ...) so callers holding
+    /// borrowed text don't need to copy it into owned `String`s first.
+    pub fn assign_labels_vector<S: AsRef<str>>(&self, texts: &[S]) -> Vec<Vec<String>> {
+        if self.matcher.is_none() {
+            return texts
+                .iter()
+                .map(|text| self.unique_labels(text.as_ref()))
+                .collect();
+        }
+        let masks = self.assign_label_masks_vector(texts);
+        self.map_mask_rows(&masks, texts.len(), |mask| self.mask_labels(mask))
+    }
+
+    /// Same as `assign_labels_vector`, but spreads the texts across rayon's thread
+    /// pool. Small batches are labelled serially, where scheduling would cost more
+    /// than it saves.
+    #[cfg(feature = "parallel")]
+    pub fn par_assign_labels_vector<S: AsRef<str> + Sync>(&self, texts: &[S]) -> Vec<Vec<String>> {
+        if self.matcher.is_none() {
+            return par_map(texts, |text| self.unique_labels(text));
+        }
+        let masks = self.par_assign_label_masks_vector(texts);
+        self.map_mask_rows(&masks, texts.len(), |mask| self.mask_labels(mask))
+    }
+
+    /// The distinct labels of the active rules, which `assign_label_ids` and
+    /// friends refer to by index. Empty until the RuleBox is compiled.
+    pub fn label_names(&self) -> &[String] {
+        self.matcher
+            .as_ref()
+            .map_or(&[], |matcher| matcher.labels())
+    }
+
+    /// Same as `assign_labels`, but returns indices into `label_names` so callers
+    /// can map them onto their own copies of the labels
+    pub fn assign_label_ids(&self, text: &str) -> Vec<usize> {
+        match &self.matcher {
+            Some(matcher) => matcher.matching_labels(text),
+            None => Vec::new(),
+        }
+    }
+
+    pub fn assign_label_ids_vector<S: AsRef<str>>(&self, texts: &[S]) -> Vec<Vec<usize>> {
+        let masks = self.assign_label_masks_vector(texts);
+        self.map_mask_rows(&masks, texts.len(), |mask| mask_label_ids(mask).collect())
+    }
+
+    #[cfg(feature = "parallel")]
+    pub fn par_assign_label_ids_vector<S: AsRef<str> + Sync>(
+        &self,
+        texts: &[S],
+    ) -> Vec<Vec<usize>> {
+        let masks = self.par_assign_label_masks_vector(texts);
+        self.map_mask_rows(&masks, texts.len(), |mask| mask_label_ids(mask).collect())
+    }
+
+    /// Number of `u64` words in each label mask returned by `assign_label_mask`
+    /// and friends. Zero until the RuleBox is compiled.
+    pub fn label_mask_words(&self) -> usize {
+        self.matcher
+            .as_ref()
+            .map_or(0, |matcher| matcher.mask_words())
+    }
+
+    /// The labels matching `text` as a bitmask over `label_names`: label `id` is
+    /// bit `id % 64` of word `id / 64`. Read it back with `mask_label_ids`.
+    pub fn assign_label_mask(&self, text: &str) -> Vec<u64> {
+        let mut mask = vec![0; self.label_mask_words()];
+        if let Some(matcher) = &self.matcher {
+            matcher.fill_label_mask(text, &mut mask, &mut matcher.pooled_scratch());
+        }
+        mask
+    }
+
+    /// The label masks of every text, laid end to end in one allocation: the mask
+    /// of `texts[i]` is `label_mask_words()` words starting at `i * label_mask_words()`
+    pub fn assign_label_masks_vector<S: AsRef<str>>(&self, texts: &[S]) -> Vec<u64> {
+        let words = self.label_mask_words();
+        let mut masks = vec![0; texts.len() * words];
+        // No labels (or not compiled) leaves nothing to fill
+        if let Some(matcher) = self.matcher.as_ref().filter(|_| words > 0) {
+            matcher.fill_label_masks(texts, &mut masks, &mut matcher.scratch());
+        }
+        masks
     }
 
-    pub fn assign_labels_vector(&self, texts: &[String]) -> Vec<Vec<String>> {
-        // Optimized implementation: pre-filter active rules and use explicit loops
-        let active_rules: Vec<&LabelRule> = self.0.iter().filter(|rule| rule.active).collect();
-        let mut results = Vec::with_capacity(texts.len());
+    #[cfg(feature = "parallel")]
+    pub fn par_assign_label_masks_vector<S: AsRef<str> + Sync>(&self, texts: &[S]) -> Vec<u64> {
+        let words = self.label_mask_words();
+        if texts.len() < PARALLEL_THRESHOLD || words == 0 {
+            return self.assign_label_masks_vector(texts);
+        }
+        let mut masks = vec![0; texts.len() * words];
+        if let Some(matcher) = &self.matcher {
+            masks
+                .par_chunks_mut(words * LANES)
+                .zip(texts.par_chunks(LANES))
+                // One scratch per rayon job rather than per text
+                .for_each_init(
+                    || matcher.scratch(),
+                    |scratch, (masks, texts)| matcher.fill_label_masks(texts, masks, scratch),
+                );
+        }
+        masks
+    }
+
+    // Apply `f` to the mask of each of `rows` texts in `masks`, as laid out by
+    // assign_label_masks_vector
+    fn map_mask_rows<T>(&self, masks: &[u64], rows: usize, f: impl Fn(&[u64]) -> T) -> Vec<T> {
+        let words = self.label_mask_words();
+        (0..rows)
+            .map(|row| f(&masks[row * words..][..words]))
+            .collect()
+    }
+
+    fn mask_labels(&self, mask: &[u64]) -> Vec<String> {
+        let names = self.label_names();
+        mask_label_ids(mask).map(|id| names[id].clone()).collect()
+    }
 
-        for text in texts {
-            let mut labels = Vec::new();
-            for rule in &active_rules {
-                // Skip if we already have this label assigned
-                if !labels.contains(&rule.label) && rule.rule.check(text) {
-                    labels.push(rule.label.clone());
+    // Labels of the rules matching `text`, without duplicates
+    fn unique_labels(&self, text: &str) -> Vec<String> {
+        match &self.matcher {
+            Some(matcher) => matcher
+                .matching_labels(text)
+                .into_iter()
+                .map(|id| matcher.labels()[id].clone())
+                .collect(),
+            // Not compiled: fall back to checking each rule's own patterns
+            None => {
+                let mut labels: Vec<String> = Vec::new();
+                for rule in self.rules.iter().filter(|r| r.active) {
+                    if !labels.contains(&rule.label) && rule.rule.check(text) {
+                        labels.push(rule.label.clone());
+                    }
                 }
+                labels
             }
-            results.push(labels);
         }
-        results
     }
 }
+
+// Rules files can run to megabytes, so they're parsed from bytes (skipping the
+// separate UTF-8 check) and, with the `simd-json` feature, with SIMD structural
+// scanning. simd-json unescapes strings in place, hence the mutable buffer.
+#[cfg(feature = "simd-json")]
+fn parse_rules(json: &mut [u8]) -> Result<RuleBox, Box<dyn std::error::Error>> {
+    Ok(simd_json::serde::from_slice(json)?)
+}
+
+#[cfg(not(feature = "simd-json"))]
+fn parse_rules(json: &mut [u8]) -> Result<RuleBox, Box<dyn std::error::Error>> {
+    Ok(serde_json::from_slice(json)?)
+}
+
+/// The label ids set in a mask from `assign_label_mask`, in ascending order
+pub fn mask_label_ids(mask: &[u64]) -> impl Iterator<Item = usize> + '_ {
+    mask.iter().enumerate().flat_map(|(word, &bits)| {
+        let mut bits = bits;
+        std::iter::from_fn(move || {
+            if bits == 0 {
+                return None;
+            }
+            let bit = bits.trailing_zeros() as usize;
+            bits &= bits - 1;
+            Some(word * 64 + bit)
+        })
+    })
+}
+
+// Apply `f` to every text, across rayon's thread pool unless there are too few
+// texts for that to pay off
+#[cfg(feature = "parallel")]
+fn par_map<S, T, F>(texts: &[S], f: F) -> Vec<T>
+where
+    S: AsRef<str> + Sync,
+    T: Send,
+    F: Fn(&str) -> T + Sync + Send,
+{
+    if texts.len() < PARALLEL_THRESHOLD {
+        return texts.iter().map(|text| f(text.as_ref())).collect();
+    }
+    texts.par_iter().map(|text| f(text.as_ref())).collect()
+}
@@ -0,0 +1,805 @@
+use crate::fold;
+use crate::prefilter::Prefilter;
+use crate::{LabelRule, RegexRule};
+use memchr::memmem::Finder;
+use regex_automata::dfa::{dense, Automaton};
+use regex_automata::meta::{self, Regex};
+use regex_automata::nfa::thompson::{self, WhichCaptures};
+use regex_automata::util::pool::{Pool, PoolGuard};
+use regex_automata::util::primitives::StateID;
+use regex_automata::{Input, MatchKind, PatternID, PatternSet};
+use regex_syntax::hir::{Hir, HirKind};
+use std::collections::HashMap;
+use std::ops::Range;
+use std::sync::OnceLock;
+
+// Size limit granted to each pattern in the combined set, matching the default
+// limit a standalone regex gets so any ruleset whose patterns compile on their
+// own also compiles as a set
+const PATTERN_SIZE_LIMIT: usize = 10 * (1 << 20);
+
+// Largest fully determinized set built for a cache; sets whose DFA would be
+// bigger are left to the lazy DFA
+const CACHED_DFA_SIZE_LIMIT: usize = 64 * (1 << 20);
+
+// Texts of at least this many bytes are matched pattern by pattern, unless
+// overridden by the RULEBOX_LONG_TEXT_THRESHOLD environment variable
+const DEFAULT_LONG_TEXT_THRESHOLD: usize = 4096;
+
+// Texts scanned together by a cached DFA in fill_label_masks
+pub const LANES: usize = 8;
+
+// Marks a rule without or_patterns / not_patterns in RuleTable
+const NO_PATTERN: u32 = u32::MAX;
+
+// The pattern ids used by each active rule, stored as parallel arrays so
+// evaluating every rule walks a few contiguous arrays rather than chasing a
+// separate allocation per rule. Only "any of" matters for the or_patterns and
+// not_patterns, so each of those groups is a single alternation pattern.
+#[derive(Debug, Default)]
+struct RuleTable {
+    labels: Vec<u32>,
+    and_ranges: Vec<Range<u32>>,
+    or_ids: Vec<u32>,
+    not_ids: Vec<u32>,
+    // The and_patterns of every rule, sliced by and_ranges
+    and_ids: Vec<u32>,
+}
+
+impl RuleTable {
+    fn push(
+        &mut self,
+        label: usize,
+        and_ids: &[usize],
+        or_id: Option<usize>,
+        not_id: Option<usize>,
+    ) {
+        let start = self.and_ids.len() as u32;
+        self.and_ids.extend(and_ids.iter().map(|&id| id as u32));
+        self.and_ranges.push(start..self.and_ids.len() as u32);
+        self.labels.push(label as u32);
+        self.or_ids.push(or_id.map_or(NO_PATTERN, |id| id as u32));
+        self.not_ids.push(not_id.map_or(NO_PATTERN, |id| id as u32));
+    }
+
+    fn len(&self) -> usize {
+        self.labels.len()
+    }
+
+    // Whether rule `rule`'s and/or patterns are satisfied, ignoring its not_patterns
+    fn requires(&self, rule: usize, mut matched: impl FnMut(usize) -> bool) -> bool {
+        let range = self.and_ranges[rule].start as usize..self.and_ranges[rule].end as usize;
+        let or_id = self.or_ids[rule];
+        self.and_ids[range].iter().all(|&id| matched(id as usize))
+            && (or_id == NO_PATTERN || matched(or_id as usize))
+    }
+
+    fn check(&self, rule: usize, mut matched: impl FnMut(usize) -> bool) -> bool {
+        let not_id = self.not_ids[rule];
+        self.requires(rule, &mut matched) && (not_id == NO_PATTERN || !matched(not_id as usize))
+    }
+
+    // Whether any rule's and/or patterns are satisfied
+    fn any_satisfiable(&self, mut matched: impl FnMut(usize) -> bool) -> bool {
+        (0..self.len()).any(|rule| self.requires(rule, &mut matched))
+    }
+
+    // Set the bits of `mask` for the labels of the rules satisfied by the patterns
+    // `matched` reports. Patterns are only asked about as rules need them.
+    fn fill_mask(&self, mut matched: impl FnMut(usize) -> bool, mask: &mut [u64]) {
+        for rule in 0..self.len() {
+            let label = self.labels[rule] as usize;
+            let (word, bit) = (label / 64, 1u64 << (label % 64));
+            // Several rules can share a label
+            if mask[word] & bit == 0 && self.check(rule, &mut matched) {
+                mask[word] |= bit;
+            }
+        }
+    }
+}
+
+// Which version of a text a pattern is matched against
+#[derive(Debug, Clone, Copy)]
+enum Haystack {
+    Text = 0,
+    // The text after fold::fold_text, for case-insensitive patterns rewritten by
+    // fold::fold_case
+    Folded = 1,
+}
+
+// How a pattern is looked for in a text
+#[derive(Debug)]
+enum Search {
+    // Plain text, found with memchr/memmem without any regex machinery
+    Literal(Haystack, Finder<'static>),
+    // Index into the haystack's pattern group
+    Group(Haystack, usize),
+}
+
+/// Every pattern of every active rule compiled into multi-pattern regexes (one for
+/// the text and one for its case-folded copy), so a text is scanned at most twice
+/// no matter how many rules there are
+#[derive(Debug)]
+pub struct Matcher {
+    searches: Vec<Search>,
+    // Indexed by Haystack
+    groups: [PatternGroup; 2],
+    // For callers matching one text at a time without scratch of their own
+    scratch_pool: Pool<MatchScratch, ScratchFn>,
+    prefilter: Option<Prefilter>,
+    rules: RuleTable,
+    labels: Vec<String>,
+}
+
+impl Matcher {
+    pub fn new(rules: &[LabelRule]) -> Result<Self, String> {
+        Self::with_dfas(rules, [None, None])
+    }
+
+    /// A matcher scanning with DFAs from `build_dfas` of a matcher for the same
+    /// rules. Its pattern sets are only built if a DFA gives up on a text.
+    pub fn with_dfas(
+        rules: &[LabelRule],
+        dfas: [Option<dense::DFA<Vec<u32>>>; 2],
+    ) -> Result<Self, String> {
+        let mut patterns = PatternIds::default();
+        let mut table = RuleTable::default();
+        let mut labels: Vec<String> = Vec::new();
+
+        for label_rule in rules.iter().filter(|r| r.active) {
+            let label = match labels.iter().position(|l| *l == label_rule.label) {
+                Some(id) => id,
+                None => {
+                    labels.push(label_rule.label.clone());
+                    labels.len() - 1
+                }
+            };
+            let rule = &label_rule.rule;
+            let and_ids = rule
+                .and_patterns
+                .iter()
+                .map(|p| patterns.id(std::slice::from_ref(p)))
+                .collect::<Result<Vec<usize>, String>>()?;
+            let or_id = patterns.alternation_id(&rule.or_patterns)?;
+            let not_id = patterns.alternation_id(&rule.not_patterns)?;
+            table.push(label, &and_ids, or_id, not_id);
+        }
+        let patterns = patterns.hirs;
+
+        let mut searches = Vec::with_capacity(patterns.len());
+        let mut group_hirs: [Vec<Hir>; 2] = Default::default();
+        for hir in &patterns {
+            let (haystack, hir) = match fold::fold_case(hir) {
+                Some(folded) => (Haystack::Folded, folded),
+                None => (Haystack::Text, hir.clone()),
+            };
+            searches.push(match hir.kind() {
+                HirKind::Literal(literal) => {
+                    Search::Literal(haystack, Finder::new(&literal.0).into_owned())
+                }
+                _ => {
+                    let hirs = &mut group_hirs[haystack as usize];
+                    hirs.push(hir);
+                    Search::Group(haystack, hirs.len() - 1)
+                }
+            });
+        }
+        let [text_hirs, folded_hirs] = group_hirs;
+        let [text_dfa, folded_dfa] = dfas;
+        let groups = match [
+            PatternGroup::new(text_hirs, text_dfa),
+            PatternGroup::new(folded_hirs, folded_dfa),
+        ] {
+            [Ok(text), Ok(folded)] => [text, folded],
+            [Err(e), _] | [_, Err(e)] => return Err(oversized_pattern(rules).unwrap_or(e)),
+        };
+
+        // Only worth scanning for atoms if the unfiltered patterns alone can't
+        // satisfy a rule, otherwise the regex scan always has to run anyway
+        let prefilter = Prefilter::new(&patterns).filter(|prefilter| {
+            let mut unfiltered = Vec::new();
+            prefilter.fill_candidates("", &mut unfiltered, &mut Vec::new());
+            !table.any_satisfiable(|id| unfiltered[id])
+        });
+
+        let pattern_lens = groups.each_ref().map(|group| group.hirs.len());
+        Ok(Self {
+            searches,
+            groups,
+            scratch_pool: Pool::new(Box::new(move || MatchScratch::new(pattern_lens))),
+            prefilter,
+            rules: table,
+            labels,
+        })
+    }
+
+    /// The distinct labels of the active rules
+    pub fn labels(&self) -> &[String] {
+        &self.labels
+    }
+
+    /// Number of `u64` words in a label mask, one bit per label
+    pub fn mask_words(&self) -> usize {
+        self.labels.len().div_ceil(64)
+    }
+
+    /// Fully determinize each pattern set, for `with_dfas` in a later process.
+    /// `None` for any set too large to determinize.
+    pub fn build_dfas(&self) -> [Option<dense::DFA<Vec<u32>>>; 2] {
+        self.groups.each_ref().map(PatternGroup::build_dfa)
+    }
+
+    /// Scratch space for `fill_label_mask`, to be reused across texts
+    pub fn scratch(&self) -> MatchScratch {
+        MatchScratch::new(self.groups.each_ref().map(|group| group.hirs.len()))
+    }
+
+    /// Scratch space shared between calls (and threads), for one-off matches
+    pub fn pooled_scratch(&self) -> PoolGuard<'_, MatchScratch, ScratchFn> {
+        self.scratch_pool.get()
+    }
+
+    /// Ids (indices into `labels`) of the labels of the rules matching `text`,
+    /// without duplicates
+    pub fn matching_labels(&self, text: &str) -> Vec<usize> {
+        let mut mask = vec![0; self.mask_words()];
+        self.fill_label_mask(text, &mut mask, &mut self.pooled_scratch());
+        crate::mask_label_ids(&mask).collect()
+    }
+
+    /// Set bit `id` of `mask` (`mask_words` long, bit `id % 64` of word `id / 64`)
+    /// for each label id matching `text`
+    pub fn fill_label_mask(&self, text: &str, mask: &mut [u64], scratch: &mut MatchScratch) {
+        self.fill_prepared_mask(text, mask, scratch, Prepared::default());
+    }
+
+    /// `fill_label_mask` for each of `texts`, into consecutive `mask_words()`
+    /// word chunks of `masks`. With DFAs from `with_dfas`, short texts are
+    /// scanned several at a time, interleaving their DFA transitions.
+    pub fn fill_label_masks<S: AsRef<str>>(
+        &self,
+        texts: &[S],
+        masks: &mut [u64],
+        scratch: &mut MatchScratch,
+    ) {
+        let words = self.mask_words();
+        if self.groups.iter().all(|group| group.dfa.is_none()) {
+            for (mask, text) in masks.chunks_mut(words).zip(texts) {
+                self.fill_label_mask(text.as_ref(), mask, scratch);
+            }
+            return;
+        }
+        for (masks, texts) in masks.chunks_mut(words * LANES).zip(texts.chunks(LANES)) {
+            self.fill_lanes(texts, masks, scratch);
+        }
+    }
+
+    // Label up to LANES texts: run the prefilter over each, scan the haystacks
+    // of those that could match a rule together, then label them one by one
+    fn fill_lanes<S: AsRef<str>>(
+        &self,
+        texts: &[S],
+        masks: &mut [u64],
+        scratch: &mut MatchScratch,
+    ) {
+        let long_text = long_text_threshold();
+        let fold = self.groups[Haystack::Folded as usize].dfa.is_some();
+        if scratch.lanes.is_empty() {
+            scratch.lanes.resize_with(LANES, Lane::default);
+            for (group, sets) in scratch.groups.iter().zip(&mut scratch.lane_sets) {
+                sets.resize(LANES, PatternSet::new(group.set_matches.capacity()));
+            }
+        }
+
+        let mut prepared = [None; LANES];
+        for ((lane, text), prepared) in scratch.lanes.iter_mut().zip(texts).zip(&mut prepared) {
+            let text = text.as_ref();
+            let mut ready = Prepared::default();
+            if let Some(prefilter) = &self.prefilter {
+                prefilter.fill_candidates(text, &mut lane.candidates, &mut scratch.seen_atoms);
+                if !self.rules.any_satisfiable(|id| lane.candidates[id]) {
+                    continue;
+                }
+                ready.candidates = true;
+            }
+            // Long texts are matched pattern by pattern instead (see is_match)
+            if fold && text.len() < long_text {
+                fold::fold_text(text, &mut lane.folded);
+                ready.folded = true;
+            }
+            *prepared = Some(ready);
+        }
+
+        for (haystack, group) in [Haystack::Text, Haystack::Folded]
+            .into_iter()
+            .zip(&self.groups)
+        {
+            let mut haystacks = [None; LANES];
+            for (i, text) in texts.iter().enumerate() {
+                let text = text.as_ref();
+                if prepared[i].is_some() && text.len() < long_text {
+                    haystacks[i] = Some(match haystack {
+                        Haystack::Text => text,
+                        Haystack::Folded => scratch.lanes[i].folded.as_str(),
+                    });
+                }
+            }
+            let sets = &mut scratch.lane_sets[haystack as usize];
+            let scanned = group.scan_lanes(&haystacks, sets);
+            for (prepared, scanned) in prepared.iter_mut().zip(scanned) {
+                if let Some(prepared) = prepared {
+                    prepared.scanned[haystack as usize] = scanned;
+                }
+            }
+        }
+
+        let words = self.mask_words();
+        for (i, (mask, text)) in masks.chunks_mut(words).zip(texts).enumerate() {
+            let Some(prepared) = prepared[i] else {
+                continue;
+            };
+            let lane = &mut scratch.lanes[i];
+            std::mem::swap(&mut scratch.candidates, &mut lane.candidates);
+            std::mem::swap(&mut scratch.folded, &mut lane.folded);
+            for (group, sets) in scratch.groups.iter_mut().zip(&mut scratch.lane_sets) {
+                std::mem::swap(&mut group.set_matches, &mut sets[i]);
+            }
+            self.fill_prepared_mask(text.as_ref(), mask, scratch, prepared);
+        }
+    }
+
+    // fill_label_mask, reusing whatever `prepared` says is already in `scratch`
+    fn fill_prepared_mask(
+        &self,
+        text: &str,
+        mask: &mut [u64],
+        scratch: &mut MatchScratch,
+        prepared: Prepared,
+    ) {
+        let MatchScratch {
+            groups,
+            folded,
+            candidates,
+            seen_atoms,
+            known,
+            ..
+        } = scratch;
+
+        let filtered = match &self.prefilter {
+            Some(prefilter) => {
+                if !prepared.candidates {
+                    prefilter.fill_candidates(text, candidates, seen_atoms);
+                }
+                true
+            }
+            None => false,
+        };
+        let is_candidate = |id: usize| !filtered || candidates[id];
+
+        // Skip the regex scan entirely when the atoms show no rule can match
+        if !self.rules.any_satisfiable(is_candidate) {
+            return;
+        }
+
+        // Each haystack is only folded and scanned if some rule gets as far as
+        // one of its patterns
+        let mut folded_ready = prepared.folded;
+        for (group, scanned) in groups.iter_mut().zip(prepared.scanned) {
+            group.scanned = scanned;
+        }
+        known.clear();
+        known.resize(self.searches.len(), None);
+
+        let matched = |id: usize| {
+            if let Some(matched) = known[id] {
+                return matched;
+            }
+            let haystack = match &self.searches[id] {
+                Search::Literal(haystack, _) | Search::Group(haystack, _) => *haystack,
+            };
+            let haystack_text = match haystack {
+                Haystack::Text => text,
+                Haystack::Folded => {
+                    if !folded_ready {
+                        fold::fold_text(text, folded);
+                        folded_ready = true;
+                    }
+                    folded.as_str()
+                }
+            };
+            let matched = is_candidate(id)
+                && match &self.searches[id] {
+                    Search::Literal(_, finder) => finder.find(haystack_text.as_bytes()).is_some(),
+                    Search::Group(_, group_id) => self.groups[haystack as usize].is_match(
+                        *group_id,
+                        haystack_text,
+                        &mut groups[haystack as usize],
+                    ),
+                };
+            known[id] = Some(matched);
+            matched
+        };
+        self.rules.fill_mask(matched, mask);
+    }
+}
+
+// Patterns matched against the same haystack
+#[derive(Debug)]
+struct PatternGroup {
+    hirs: Vec<Hir>,
+    // Built up front, unless a DFA stands in for it; then only once the DFA
+    // gives up on a text
+    set: OnceLock<Regex>,
+    // A fully determinized copy of `set`, loaded from a cache
+    dfa: Option<dense::DFA<Vec<u32>>>,
+    // One regex per pattern, for long texts; compiled when first needed
+    regexes: OnceLock<Option<Vec<Regex>>>,
+}
+
+impl PatternGroup {
+    fn new(hirs: Vec<Hir>, dfa: Option<dense::DFA<Vec<u32>>>) -> Result<Self, String> {
+        if dfa
+            .as_ref()
+            .is_some_and(|dfa| dfa.pattern_len() != hirs.len())
+        {
+            return Err("Cached matcher doesn't match the rules".into());
+        }
+        let set = match dfa {
+            Some(_) => OnceLock::new(),
+            None => OnceLock::from(build_set(&hirs)?),
+        };
+        Ok(Self {
+            hirs,
+            set,
+            dfa,
+            regexes: OnceLock::new(),
+        })
+    }
+
+    fn set(&self) -> &Regex {
+        // A DFA only comes from a cache written by a matcher that built this
+        // same set, so building it can't fail
+        self.set
+            .get_or_init(|| build_set(&self.hirs).expect("Cached pattern set failed to build"))
+    }
+
+    fn build_dfa(&self) -> Option<dense::DFA<Vec<u32>>> {
+        if self.hirs.is_empty() {
+            return None;
+        }
+        let nfa = thompson::Compiler::new()
+            .configure(thompson::Config::new().which_captures(WhichCaptures::None))
+            .build_many_from_hir(&self.hirs)
+            .ok()?;
+        dense::Builder::new()
+            .configure(
+                dense::Config::new()
+                    .match_kind(MatchKind::All)
+                    // Gives up on non-ASCII text rather than refusing \b
+                    .unicode_word_boundary(true)
+                    .dfa_size_limit(Some(CACHED_DFA_SIZE_LIMIT))
+                    .determinize_size_limit(Some(CACHED_DFA_SIZE_LIMIT)),
+            )
+            .build_from_nfa(&nfa)
+            .ok()
+    }
+
+    // Scan each of `haystacks` (up to LANES of them; `None` to skip one) with
+    // the cached DFA in lockstep, one byte of every haystack per step, putting
+    // the patterns that match it in the corresponding set. No transition
+    // depends on another haystack's, so the CPU can overlap the table lookups
+    // that a single scan has to make one after another. Returns which
+    // haystacks were scanned: none without a DFA, and not those it gives up on
+    // (see build_dfa).
+    fn scan_lanes(&self, haystacks: &[Option<&str>], sets: &mut [PatternSet]) -> [bool; LANES] {
+        let mut scanned = [false; LANES];
+        let Some(dfa) = &self.dfa else {
+            return scanned;
+        };
+        let mut states = [StateID::ZERO; LANES];
+        let mut longest = 0;
+        for (lane, haystack) in haystacks.iter().enumerate() {
+            let Some(haystack) = haystack else { continue };
+            if let Ok(start) = dfa.start_state_forward(&Input::new(haystack)) {
+                states[lane] = start;
+                scanned[lane] = true;
+                sets[lane].clear();
+                longest = longest.max(haystack.len());
+            }
+        }
+
+        // Each haystack takes one more step past its end, for the end of input
+        let mut live = scanned;
+        for at in 0..=longest {
+            for (lane, haystack) in haystacks.iter().enumerate() {
+                if !live[lane] {
+                    continue;
+                }
+                let bytes = haystack.unwrap_or_default().as_bytes();
+                let state = match bytes.get(at) {
+                    Some(&byte) => dfa.next_state(states[lane], byte),
+                    None => {
+                        live[lane] = false;
+                        dfa.next_eoi_state(states[lane])
+                    }
+                };
+                states[lane] = state;
+                if !dfa.is_special_state(state) {
+                    continue;
+                }
+                if dfa.is_match_state(state) {
+                    for i in 0..dfa.match_len(state) {
+                        sets[lane].insert(dfa.match_pattern(state, i));
+                    }
+                } else if dfa.is_dead_state(state) {
+                    live[lane] = false;
+                } else if dfa.is_quit_state(state) {
+                    live[lane] = false;
+                    scanned[lane] = false;
+                }
+            }
+        }
+        scanned
+    }
+
+    // Whether pattern `id` matches `haystack`. The set reads the whole haystack
+    // to find every matching pattern (once, on the first call for a haystack),
+    // while a single regex stops at its first match and rules stop asking once
+    // decided, which wins on long texts.
+    fn is_match(&self, id: usize, haystack: &str, scratch: &mut GroupScratch) -> bool {
+        let input = Input::new(haystack);
+        if haystack.len() >= long_text_threshold() {
+            if let Some(regexes) = self.regexes() {
+                if scratch.regex_caches.is_empty() {
+                    scratch
+                        .regex_caches
+                        .extend(regexes.iter().map(|regex| regex.create_cache()));
+                }
+                return regexes[id]
+                    .search_half_with(&mut scratch.regex_caches[id], &input.earliest(true))
+                    .is_some();
+            }
+        }
+        if !scratch.scanned {
+            scratch.set_matches.clear();
+            // The DFA needs no cache, but gives up on some texts (see build_dfa)
+            let dfa_scanned = self.dfa.as_ref().is_some_and(|dfa| {
+                dfa.try_which_overlapping_matches(&input, &mut scratch.set_matches)
+                    .is_ok()
+            });
+            if !dfa_scanned {
+                scratch.set_matches.clear();
+                let set = self.set();
+                let cache = scratch.set_cache.get_or_insert_with(|| set.create_cache());
+                set.which_overlapping_matches_with(cache, &input, &mut scratch.set_matches);
+            }
+            scratch.scanned = true;
+        }
+        scratch.set_matches.contains(PatternID::must(id))
+    }
+
+    fn regexes(&self) -> Option<&[Regex]> {
+        self.regexes
+            .get_or_init(|| {
+                self.hirs
+                    .iter()
+                    .map(|hir| {
+                        meta::Builder::new()
+                            .configure(regex_config(MatchKind::LeftmostFirst, PATTERN_SIZE_LIMIT))
+                            .build_from_hir(hir)
+                    })
+                    .collect::<Result<Vec<_>, _>>()
+                    .ok()
+            })
+            .as_deref()
+    }
+}
+
+/// Per-thread scratch space for matching (regex caches, match sets and the like),
+/// so labelling a batch of texts allocates it once rather than once per text.
+/// Only valid with the `Matcher` that created it.
+#[derive(Debug)]
+pub struct MatchScratch {
+    // Indexed by Haystack
+    groups: [GroupScratch; 2],
+    folded: String,
+    candidates: Vec<bool>,
+    seen_atoms: Vec<bool>,
+    known: Vec<Option<bool>>,
+    // For fill_label_masks: per text of a batch, its prefilter candidates,
+    // folded text and (indexed by Haystack) the patterns the DFA found in it
+    lanes: Vec<Lane>,
+    lane_sets: [Vec<PatternSet>; 2],
+}
+
+#[derive(Debug, Default)]
+struct Lane {
+    candidates: Vec<bool>,
+    folded: String,
+}
+
+// Which of its fields fill_lanes has filled in a MatchScratch for a text
+#[derive(Debug, Default, Clone, Copy)]
+struct Prepared {
+    candidates: bool,
+    folded: bool,
+    // Indexed by Haystack
+    scanned: [bool; 2],
+}
+
+#[derive(Debug)]
+struct GroupScratch {
+    // Created on the first text the set scans
+    set_cache: Option<meta::Cache>,
+    set_matches: PatternSet,
+    // Whether set_matches is up to date for the current text
+    scanned: bool,
+    // One cache per pattern's regex, created on the first long text
+    regex_caches: Vec<meta::Cache>,
+}
+
+pub type ScratchFn = Box<dyn Fn() -> MatchScratch + Send + Sync>;
+
+impl MatchScratch {
+    // `pattern_lens` is the number of patterns in each group, indexed by Haystack
+    fn new(pattern_lens: [usize; 2]) -> Self {
+        Self {
+            groups: pattern_lens.map(|len| GroupScratch {
+                set_cache: None,
+                set_matches: PatternSet::new(len),
+                scanned: false,
+                regex_caches: Vec::new(),
+            }),
+            folded: String::new(),
+            candidates: Vec::new(),
+            seen_atoms: Vec::new(),
+            known: Vec::new(),
+            lanes: Vec::new(),
+            lane_sets: [Vec::new(), Vec::new()],
+        }
+    }
+}
+
+// All of a group's patterns as one regex, reporting every pattern that matches
+fn build_set(hirs: &[Hir]) -> Result<Regex, String> {
+    let set_limit = PATTERN_SIZE_LIMIT.saturating_mul(hirs.len().max(1));
+    meta::Builder::new()
+        .configure(regex_config(MatchKind::All, set_limit).which_captures(WhichCaptures::None))
+        .build_many_from_hir(hirs)
+        .map_err(|e| format!("Failed to combine rule patterns: {}", e))
+}
+
+// Configured the way the regex crate configures a `RegexSet` (MatchKind::All,
+// plus WhichCaptures::None) or a `Regex` (MatchKind::LeftmostFirst), with
+// `size_limit` for the NFA. A single regex keeps its captures: without them, a
+// search the lazy DFA gives up on (Unicode word boundaries on non-ASCII text)
+// can wrongly report no match.
+fn regex_config(kind: MatchKind, size_limit: usize) -> meta::Config {
+    meta::Config::new()
+        .match_kind(kind)
+        .nfa_size_limit(Some(size_limit))
+        .hybrid_cache_capacity(2 * (1 << 20))
+        .utf8_empty(true)
+}
+
+// The RULEBOX_LONG_TEXT_THRESHOLD environment variable, read once
+fn long_text_threshold() -> usize {
+    static THRESHOLD: OnceLock<usize> = OnceLock::new();
+    *THRESHOLD.get_or_init(|| {
+        std::env::var("RULEBOX_LONG_TEXT_THRESHOLD")
+            .ok()
+            .and_then(|value| value.parse().ok())
+            .unwrap_or(DEFAULT_LONG_TEXT_THRESHOLD)
+    })
+}
+
+// The first pattern of the active rules that is too large to compile on its
+// own, reported the way RegexRule::compile reports an invalid pattern. A set
+// only fails to build because of such a pattern, so its error is replaced by
+// this one, which says which pattern is at fault.
+fn oversized_pattern(rules: &[LabelRule]) -> Option<String> {
+    let mut compiler = thompson::Compiler::new();
+    compiler.configure(thompson::Config::new().nfa_size_limit(Some(PATTERN_SIZE_LIMIT)));
+    rules
+        .iter()
+        .filter(|r| r.active)
+        .flat_map(|r| {
+            let rule = &r.rule;
+            rule.and_patterns
+                .iter()
+                .chain(&rule.or_patterns)
+                .chain(&rule.not_patterns)
+        })
+        .find_map(|p| {
+            let e = compiler.build_from_hir(p.hir()?).err()?;
+            Some(format!("Invalid regex '{}': {}", p.pattern, e))
+        })
+}
+
+// The distinct patterns of a ruleset, parsed. A pattern repeated across rules
+// (or or/not groups repeated whole) gets a single id, so it is compiled and
+// matched once per text.
+#[derive(Default)]
+struct PatternIds {
+    hirs: Vec<Hir>,
+    ids: HashMap<Vec<(String, Vec<String>)>, usize>,
+}
+
+impl PatternIds {
+    // The id of a pattern matching wherever any of `rules` match
+    fn id(&mut self, rules: &[RegexRule]) -> Result<usize, String> {
+        let key: Vec<_> = rules.iter().map(RegexRule::key).collect();
+        if let Some(&id) = self.ids.get(&key) {
+            return Ok(id);
+        }
+        let hirs = rules
+            .iter()
+            .map(|r| r.hir().cloned())
+            .collect::<Option<Vec<Hir>>>()
+            .ok_or("Rules must be compiled before they are combined")?;
+        self.hirs.push(Hir::alternation(hirs));
+        self.ids.insert(key, self.hirs.len() - 1);
+        Ok(self.hirs.len() - 1)
+    }
+
+    // The id of the alternation of `rules`, if there are any
+    fn alternation_id(&mut self, rules: &[RegexRule]) -> Result<Option<usize>, String> {
+        if rules.is_empty() {
+            return Ok(None);
+        }
+        self.id(rules).map(Some)
+    }
+}
+
+#[cfg(test)]
+mod tests {
+    use crate::RuleBox;
+
+    const RULES: &str = r#"[
+        {"label": "greeting", "rule": {"or_patterns": [{"pattern": "\\bhello\\b", "flags": ["i"]}]}},
+        {"label": "farewell", "rule": {"or_patterns": [{"pattern": "\\bbye\\b"}]}}
+    ]"#;
+
+    #[test]
+    fn test_from_cache_skips_compiling() {
+        let path = std::env::temp_dir().join(format!("rulebox-lazy-{}.cache", std::process::id()));
+        let path = path.to_str().unwrap();
+        let from_json = RuleBox::from_json(RULES).expect("Failed to load rules");
+        from_json.to_cache(path).expect("Failed to write cache");
+        let from_cache = RuleBox::from_cache(path);
+        std::fs::remove_file(path).ok();
+        let from_cache = from_cache.expect("Failed to load cache");
+
+        let sets_built = |rulebox: &RuleBox| {
+            let matcher = rulebox.matcher.as_ref().unwrap();
+            matcher
+                .groups
+                .each_ref()
+                .map(|group| group.set.get().is_some())
+        };
+        let regexes_built = |rulebox: &RuleBox| {
+            rulebox.rules.iter().any(|rule| {
+                let compiled = rule.rule.or_patterns[0].compiled.as_ref().unwrap();
+                compiled.0.regex.get().is_some()
+            })
+        };
+        assert_eq!(sets_built(&from_json), [true, true]);
+        assert_eq!(sets_built(&from_cache), [false, false]);
+        assert!(!regexes_built(&from_cache));
+
+        // ASCII texts are labelled by the DFAs alone
+        assert_eq!(
+            from_cache.assign_labels("Hello, bye"),
+            ["greeting", "farewell"]
+        );
+        assert_eq!(sets_built(&from_cache), [false, false]);
+
+        // The DFAs give up on \b next to non-ASCII text, so the sets get built
+        assert_eq!(
+            from_cache.assign_labels("Héllo hello, bye ü"),
+            ["greeting", "farewell"]
+        );
+        assert_eq!(sets_built(&from_cache), [true, true]);
+        assert!(!regexes_built(&from_cache));
+    }
+}
@@ -0,0 +1,136 @@
+use aho_corasick::{AhoCorasick, AhoCorasickKind};
+use regex_syntax::hir::literal::Extractor;
+use regex_syntax::hir::{Hir, HirKind};
+use std::collections::HashMap;
+
+/// Finds, with one Aho-Corasick scan, which patterns could possibly match a text.
+///
+/// Every match of a pattern contains one of a set of literals ("atoms") found from
+/// its syntax, so a pattern whose atoms are all absent from the text cannot match
+/// it. Patterns without a usable set of atoms are always candidates.
+#[derive(Debug)]
+pub struct Prefilter {
+    ac: AhoCorasick,
+    atom_patterns: Vec<Vec<usize>>,
+    unfiltered: Vec<usize>,
+    pattern_count: usize,
+}
+
+impl Prefilter {
+    /// Build a prefilter for `patterns`, or `None` if none of them have atoms
+    pub fn new(patterns: &[Hir]) -> Option<Self> {
+        let mut atom_ids: HashMap<Vec<u8>, usize> = HashMap::new();
+        let mut atoms = Vec::new();
+        let mut atom_patterns: Vec<Vec<usize>> = Vec::new();
+        let mut unfiltered = Vec::new();
+
+        for (id, pattern) in patterns.iter().enumerate() {
+            let Some(pattern_atoms) = hir_atoms(pattern) else {
+                unfiltered.push(id);
+                continue;
+            };
+            for atom in pattern_atoms {
+                let atom_id = *atom_ids.entry(atom.clone()).or_insert_with(|| {
+                    atoms.push(atom);
+                    atom_patterns.push(Vec::new());
+                    atom_patterns.len() - 1
+                });
+                if atom_patterns[atom_id].last() != Some(&id) {
+                    atom_patterns[atom_id].push(id);
+                }
+            }
+        }
+
+        if atoms.is_empty() {
+            return None;
+        }
+        let ac = build_automaton(&atoms)?;
+
+        Some(Self {
+            ac,
+            atom_patterns,
+            unfiltered,
+            pattern_count: patterns.len(),
+        })
+    }
+
+    /// Flags, by pattern id, the patterns that could match `text` in `candidates`.
+    /// Both vectors are overwritten, and only passed in so they can be reused.
+    pub fn fill_candidates(&self, text: &str, candidates: &mut Vec<bool>, seen: &mut Vec<bool>) {
+        candidates.clear();
+        candidates.resize(self.pattern_count, false);
+        for &id in &self.unfiltered {
+            candidates[id] = true;
+        }
+
+        seen.clear();
+        seen.resize(self.atom_patterns.len(), false);
+        for hit in self.ac.find_overlapping_iter(text) {
+            let atom = hit.pattern().as_usize();
+            if !seen[atom] {
+                seen[atom] = true;
+                for &id in &self.atom_patterns[atom] {
+                    candidates[id] = true;
+                }
+            }
+        }
+    }
+}
+
+// A DFA takes one transition per byte with no failure links to follow, and with
+// the prefilter on, candidate positions are found with the vectorised literal
+// search when the `simd` feature is enabled. Large atom sets can exceed the DFA's
+// state limit, in which case the builder picks the automaton instead.
+fn build_automaton(atoms: &[Vec<u8>]) -> Option<AhoCorasick> {
+    let mut builder = AhoCorasick::builder();
+    builder.ascii_case_insensitive(true).prefilter(true);
+    builder
+        .kind(Some(AhoCorasickKind::DFA))
+        .build(atoms)
+        .or_else(|_| builder.kind(None).build(atoms))
+        .ok()
+}
+
+// Literals one of which occurs in every match of `hir`, lowercased since they
+// are searched for case-insensitively. `None` if they can't be determined.
+fn hir_atoms(hir: &Hir) -> Option<Vec<Vec<u8>>> {
+    if let Some(atoms) = prefix_atoms(hir) {
+        return Some(atoms);
+    }
+    match hir.kind() {
+        // Every match also contains a match of each tail of a concatenation, so
+        // for patterns such as `[a-z]+@[a-z]+` the prefix of a tail (`@`) will do
+        HirKind::Concat(subs) => {
+            (1..subs.len()).find_map(|start| prefix_atoms(&Hir::concat(subs[start..].to_vec())))
+        }
+        // Every match is a match of one of the branches
+        HirKind::Alternation(subs) => {
+            let mut atoms = Vec::new();
+            for sub in subs {
+                atoms.extend(hir_atoms(sub)?);
+            }
+            atoms.sort_unstable();
+            atoms.dedup();
+            Some(atoms)
+        }
+        HirKind::Capture(capture) => hir_atoms(&capture.sub),
+        _ => None,
+    }
+}
+
+// Prefix literals one of which starts every match of `hir`
+fn prefix_atoms(hir: &Hir) -> Option<Vec<Vec<u8>>> {
+    let seq = Extractor::new().extract(hir);
+    let literals = seq.literals()?;
+
+    if literals.is_empty() || literals.iter().any(|lit| lit.as_bytes().is_empty()) {
+        return None;
+    }
+    let mut atoms: Vec<Vec<u8>> = literals
+        .iter()
+        .map(|lit| lit.as_bytes().to_ascii_lowercase())
+        .collect();
+    atoms.sort_unstable();
+    atoms.dedup();
+    Some(atoms)
+}
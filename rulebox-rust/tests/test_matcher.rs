@@ -0,0 +1,482 @@
+#[cfg(test)]
+mod tests {
+    use rulebox_rust::*;
+    use std::collections::HashSet;
+
+    const RULES: &str = r#"[
+        {"label": "greeting", "rule": {"or_patterns": [
+            {"pattern": "\\bhello\\b", "flags": ["i"]},
+            {"pattern": "\\bhi\\b", "flags": ["i"]}
+        ]}},
+        {"label": "question", "rule": {"and_patterns": [{"pattern": "\\?"}]}},
+        {"label": "urgent", "rule": {"and_patterns": [
+            {"pattern": "urgent", "flags": ["i"]},
+            {"pattern": "asap|immediately|now", "flags": ["i"]}
+        ]}},
+        {"label": "not_spam", "rule": {
+            "or_patterns": [{"pattern": "legitimate"}],
+            "not_patterns": [
+                {"pattern": "click here", "flags": ["i"]},
+                {"pattern": "free money", "flags": ["i"]}
+            ]
+        }},
+        {"label": "line_start", "rule": {"or_patterns": [{"pattern": "^motion", "flags": ["m", "i"]}]}},
+        {"label": "greeting", "rule": {"or_patterns": [{"pattern": "good morning", "flags": ["i"]}]}},
+        {"label": "inactive", "active": false, "rule": {"or_patterns": [{"pattern": "hello"}]}}
+    ]"#;
+
+    const TEXTS: [&str; 8] = [
+        "Hello world",
+        "This is a test",
+        "Is this URGENT? Do it asap",
+        "urgent but not time-sensitive",
+        "A legitimate request",
+        "legitimate offer, click here for free money",
+        "Preamble\nMOTION to adjourn",
+        "Good morning, hi!",
+    ];
+
+    fn expected(rulebox: &RuleBox, text: &str) -> HashSet<String> {
+        rulebox
+            .rules
+            .iter()
+            .filter(|rule| rule.active && rule.rule.check(text))
+            .map(|rule| rule.label.clone())
+            .collect()
+    }
+
+    #[test]
+    fn test_matcher_agrees_with_rule_check() {
+        let rulebox = RuleBox::from_json(RULES).expect("Failed to load rules");
+
+        for text in TEXTS {
+            let labels: HashSet<String> = rulebox.assign_labels(text).into_iter().collect();
+            assert_eq!(labels, expected(&rulebox, text), "text: {:?}", text);
+        }
+
+        let results = rulebox.assign_labels_vector(&TEXTS);
+        for (text, labels) in TEXTS.iter().zip(results) {
+            let unique: HashSet<String> = labels.iter().cloned().collect();
+            assert_eq!(
+                unique.len(),
+                labels.len(),
+                "duplicate labels for {:?}",
+                text
+            );
+            assert_eq!(unique, expected(&rulebox, text), "text: {:?}", text);
+        }
+    }
+
+    #[test]
+    fn test_matcher_rule_logic() {
+        let rulebox = RuleBox::from_json(RULES).expect("Failed to load rules");
+        let results = rulebox.assign_labels_vector(&TEXTS);
+        let has = |i: usize, label: &str| results[i].iter().any(|l| l == label);
+
+        assert!(has(0, "greeting"));
+        assert!(!has(1, "greeting"));
+        assert!(has(2, "urgent") && has(2, "question"));
+        assert!(!has(3, "urgent"));
+        assert!(has(4, "not_spam"));
+        assert!(!has(5, "not_spam"));
+        assert!(has(6, "line_start"));
+        assert_eq!(results[7], vec!["greeting".to_string()]);
+        assert!(results
+            .iter()
+            .all(|labels| !labels.iter().any(|l| l == "inactive")));
+    }
+
+    #[test]
+    fn test_prefilter_never_hides_matches() {
+        let rules = r#"[
+            {"label": "economic", "rule": {"or_patterns": [
+                {"pattern": "budget|taxation|fiscal", "flags": ["i"]},
+                {"pattern": "£[0-9,]+|\\$[0-9,]+"}
+            ]}},
+            {"label": "health", "rule": {"and_patterns": [
+                {"pattern": "health|medical|nhs|hospital", "flags": ["i"]},
+                {"pattern": "service|care|treatment|funding", "flags": ["i"]}
+            ]}},
+            {"label": "kelvin", "rule": {"or_patterns": [{"pattern": "kelvin", "flags": ["i"]}]}},
+            {"label": "email", "rule": {"or_patterns": [
+                {"pattern": "[a-zA-Z0-9._%+-]+@[a-zA-Z0-9.-]+\\.[a-zA-Z]{2,}"}
+            ]}},
+            {"label": "environment", "rule": {
+                "or_patterns": [{"pattern": "\\benviron\\w*", "flags": ["i"]}],
+                "not_patterns": [{"pattern": "business environment", "flags": ["i"]}]
+            }}
+        ]"#;
+        let rulebox = RuleBox::from_json(rules).expect("Failed to load rules");
+
+        let texts = [
+            "Motion to establish parliamentary committees for constitutional review",
+            "A FISCAL statement with £500 million",
+            "It costs $20",
+            "Motion on NHS hospital TREATMENT",
+            "Hospital buildings",
+            "\u{212A}ELVIN temperatures",
+            "Environmental review of the business environment",
+            "ENVIRONMENTAL review",
+            "Contact test@example.com",
+            "An @ on its own",
+            "",
+        ];
+        for text in texts {
+            let labels: HashSet<String> = rulebox.assign_labels(text).into_iter().collect();
+            assert_eq!(labels, expected(&rulebox, text), "text: {:?}", text);
+        }
+        assert!(rulebox.assign_labels(texts[0]).is_empty());
+        assert_eq!(rulebox.assign_labels(texts[5]), vec!["kelvin".to_string()]);
+    }
+
+    #[test]
+    fn test_literal_patterns() {
+        // Every pattern here is plain text, so no regex is involved at all
+        let rules = r#"[
+            {"label": "question", "rule": {"and_patterns": [{"pattern": "\\?"}]}},
+            {"label": "pounds", "rule": {"or_patterns": [{"pattern": "£"}, {"pattern": "GBP"}]}},
+            {"label": "motion", "rule": {
+                "and_patterns": [{"pattern": "motion", "flags": ["m"]}],
+                "not_patterns": [{"pattern": "withdrawn"}]
+            }}
+        ]"#;
+        let rulebox = RuleBox::from_json(rules).expect("Failed to load rules");
+
+        let texts = [
+            "Is this a question?",
+            "It costs £5",
+            "Priced in GBP? Yes",
+            "A motion on pensions",
+            "A motion, withdrawn",
+            "Motion (capitalised)",
+            "",
+        ];
+        for text in texts {
+            let labels: HashSet<String> = rulebox.assign_labels(text).into_iter().collect();
+            assert_eq!(labels, expected(&rulebox, text), "text: {:?}", text);
+        }
+        assert_eq!(rulebox.assign_labels(texts[2]), vec!["question", "pounds"]);
+    }
+
+    #[test]
+    fn test_repeated_patterns() {
+        // The same patterns shared between labels, and between the or_patterns of
+        // one rule and the not_patterns of another
+        let rules = r#"[
+            {"label": "environment", "rule": {"or_patterns": [{"pattern": "environment", "flags": ["i"]}]}},
+            {"label": "climate", "rule": {"and_patterns": [
+                {"pattern": "environment", "flags": ["i"]},
+                {"pattern": "climate"}
+            ]}},
+            {"label": "other", "rule": {
+                "and_patterns": [{"pattern": "climate"}],
+                "not_patterns": [{"pattern": "environment", "flags": ["i"]}]
+            }},
+            {"label": "case_sensitive", "rule": {"or_patterns": [{"pattern": "environment"}]}}
+        ]"#;
+        let rulebox = RuleBox::from_json(rules).expect("Failed to load rules");
+
+        let texts = [
+            "ENVIRONMENT and climate",
+            "climate alone",
+            "the environment",
+            "nothing",
+        ];
+        for text in texts {
+            let labels: HashSet<String> = rulebox.assign_labels(text).into_iter().collect();
+            assert_eq!(labels, expected(&rulebox, text), "text: {:?}", text);
+        }
+        assert_eq!(
+            rulebox.assign_labels(texts[0]),
+            vec!["environment", "climate"]
+        );
+        assert_eq!(rulebox.assign_labels(texts[1]), vec!["other"]);
+    }
+
+    #[test]
+    fn test_case_insensitive_unicode_texts() {
+        let rules = r#"[
+            {"label": "kelvin", "rule": {"or_patterns": [{"pattern": "\\bkelvin\\b", "flags": ["i"]}]}},
+            {"label": "street", "rule": {"or_patterns": [{"pattern": "straße", "flags": ["i"]}]}},
+            {"label": "sigma", "rule": {"or_patterns": [{"pattern": "σ[a-z]+", "flags": ["i"]}]}},
+            {"label": "ascii_boundary", "rule": {"or_patterns": [{"pattern": "(?-u:\\b)ks", "flags": ["i"]}]}},
+            {"label": "mixed", "rule": {"and_patterns": [
+                {"pattern": "budget", "flags": ["i"]},
+                {"pattern": "Motion"}
+            ]}}
+        ]"#;
+        let rulebox = RuleBox::from_json(rules).expect("Failed to load rules");
+
+        let texts = [
+            "\u{212A}ELVIN",
+            "STRASSE",
+            "STRAẞE and Straße",
+            "ſtraße",
+            "ΣIGMA",
+            "ςabc",
+            "é\u{212A}S",
+            "\u{212A}s",
+            "BUDGET Motion",
+            "BUDGET motion",
+        ];
+        for text in texts {
+            for text in [
+                text.to_string(),
+                format!("{} {}", "filler ".repeat(700), text),
+            ] {
+                let labels: HashSet<String> = rulebox.assign_labels(&text).into_iter().collect();
+                assert_eq!(labels, expected(&rulebox, &text), "text: {:?}", text);
+            }
+        }
+    }
+
+    #[test]
+    fn test_long_texts_agree_with_rule_check() {
+        let rulebox = RuleBox::from_json(RULES).expect("Failed to load rules");
+        let filler = "Lorem ipsum dolor sit amet. ".repeat(200);
+
+        for text in TEXTS {
+            // Matches at the start, at the end, and spanning a line break
+            for long in [
+                format!("{}{}", text, filler),
+                format!("{}{}", filler, text),
+                format!("{}\n{}", filler, text),
+            ] {
+                assert!(long.len() > 4096);
+                let labels: HashSet<String> = rulebox.assign_labels(&long).into_iter().collect();
+                assert_eq!(labels, expected(&rulebox, &long), "text: {:?}", text);
+            }
+        }
+    }
+
+    #[test]
+    fn test_long_non_ascii_texts_with_word_boundaries() {
+        let rules = r#"[
+            {"label": "cafe", "rule": {"or_patterns": [{"pattern": "\\bcafé\\b"}]}},
+            {"label": "hello", "rule": {"and_patterns": [{"pattern": "\\bhello\\b"}]}},
+            {"label": "word", "rule": {"or_patterns": [{"pattern": "\\b\\w+ünd\\b"}]}}
+        ]"#;
+        let rulebox = RuleBox::from_json(rules).expect("Failed to load rules");
+        let filler = "Grüße aus Köln, schönen Tag. ".repeat(200);
+
+        // The lazy DFA gives up on Unicode word boundaries in non-ASCII text,
+        // leaving the long-text regexes to fall back to other engines
+        for text in ["hello", "café", "the hünd", "cafés", "Othello"] {
+            for long in [
+                format!("{} {}", filler, text),
+                format!("{} {}", text, filler),
+            ] {
+                assert!(long.len() > 4096);
+                let labels: HashSet<String> = rulebox.assign_labels(&long).into_iter().collect();
+                assert_eq!(labels, expected(&rulebox, &long), "text: {:?}", text);
+            }
+        }
+    }
+
+    #[test]
+    fn test_label_ids_match_labels() {
+        let rulebox = RuleBox::from_json(RULES).expect("Failed to load rules");
+        let names = rulebox.label_names();
+
+        // Shared labels appear once and inactive rules' labels not at all
+        assert_eq!(names.iter().filter(|l| *l == "greeting").count(), 1);
+        assert!(!names.iter().any(|l| l == "inactive"));
+
+        let ids = rulebox.assign_label_ids_vector(&TEXTS);
+        let labels = rulebox.assign_labels_vector(&TEXTS);
+        for (ids, labels) in ids.iter().zip(&labels) {
+            let named: Vec<&String> = ids.iter().map(|&id| &names[id]).collect();
+            assert_eq!(named, labels.iter().collect::<Vec<_>>());
+        }
+    }
+
+    #[test]
+    fn test_label_masks_beyond_one_word() {
+        // 70 labels need two mask words; label i matches "word{i % 3}"
+        let rules: Vec<String> = (0..70)
+            .map(|i| {
+                format!(
+                    r#"{{"label": "label{i}", "rule": {{"or_patterns": [{{"pattern": "\\bword{}\\b"}}]}}}}"#,
+                    i % 3
+                )
+            })
+            .collect();
+        let rulebox =
+            RuleBox::from_json(&format!("[{}]", rules.join(","))).expect("Failed to load rules");
+        assert_eq!(rulebox.label_mask_words(), 2);
+
+        let texts = ["word0 here", "nothing", "word1 and word2"];
+        let masks = rulebox.assign_label_masks_vector(&texts);
+        assert_eq!(masks.len(), texts.len() * 2);
+
+        for (i, text) in texts.iter().enumerate() {
+            let mask = &masks[i * 2..(i + 1) * 2];
+            assert_eq!(mask, rulebox.assign_label_mask(text).as_slice());
+            let ids: Vec<usize> = mask_label_ids(mask).collect();
+            assert_eq!(ids, rulebox.assign_label_ids(text));
+        }
+        let ids: Vec<usize> = mask_label_ids(&masks[0..2]).collect();
+        assert_eq!(ids, (0..70).step_by(3).collect::<Vec<_>>());
+        assert!(mask_label_ids(&masks[2..4]).next().is_none());
+    }
+
+    #[cfg(feature = "parallel")]
+    #[test]
+    fn test_parallel_labels_match_serial() {
+        let rulebox = RuleBox::from_json(RULES).expect("Failed to load rules");
+        let texts: Vec<&str> = TEXTS.iter().cycle().take(1000).copied().collect();
+
+        assert_eq!(
+            rulebox.par_assign_labels_vector(&texts),
+            rulebox.assign_labels_vector(&texts)
+        );
+        assert_eq!(
+            rulebox.par_assign_label_masks_vector(&texts),
+            rulebox.assign_label_masks_vector(&texts)
+        );
+    }
+
+    #[test]
+    fn test_from_path_matches_from_json() {
+        let path = std::env::temp_dir().join(format!("rulebox-{}.json", std::process::id()));
+        std::fs::write(&path, RULES).expect("Failed to write rules");
+        let from_path = RuleBox::from_path(path.to_str().unwrap());
+        std::fs::remove_file(&path).ok();
+
+        let from_path = from_path.expect("Failed to load rules");
+        let from_json = RuleBox::from_json(RULES).expect("Failed to load rules");
+        assert_eq!(
+            from_path.assign_labels_vector(&TEXTS),
+            from_json.assign_labels_vector(&TEXTS)
+        );
+        assert!(RuleBox::from_path("/nonexistent/rules.json").is_err());
+    }
+
+    #[test]
+    fn test_from_cache_matches_from_json() {
+        let path = std::env::temp_dir().join(format!("rulebox-{}.cache", std::process::id()));
+        let path = path.to_str().unwrap();
+        let from_json = RuleBox::from_json(RULES).expect("Failed to load rules");
+        from_json.to_cache(path).expect("Failed to write cache");
+        let from_cache = RuleBox::from_cache(path);
+        std::fs::remove_file(path).ok();
+
+        // Non-ASCII texts, where the cached DFA gives up on \b, included
+        let from_cache = from_cache.expect("Failed to load cache");
+        let mut texts: Vec<String> = TEXTS.iter().map(|t| t.to_string()).collect();
+        texts.push("Héllo wörld, hi!".to_string());
+        texts.push(format!(
+            "{}hello",
+            "Lorem ipsum dolor sit amet. ".repeat(200)
+        ));
+        assert_eq!(from_cache.rules.len(), from_json.rules.len());
+        assert_eq!(
+            from_cache.assign_labels_vector(&texts),
+            from_json.assign_labels_vector(&texts)
+        );
+        assert!(RuleBox::from_cache("/nonexistent/rules.cache").is_err());
+
+        let uncompiled: RuleBox = serde_json::from_str(RULES).expect("Failed to parse rules");
+        assert!(uncompiled.to_cache(path).is_err());
+    }
+
+    #[test]
+    fn test_cached_batches_agree_with_rule_check() {
+        let path = std::env::temp_dir().join(format!("rulebox-batch-{}.cache", std::process::id()));
+        let path = path.to_str().unwrap();
+        RuleBox::from_json(RULES)
+            .expect("Failed to load rules")
+            .to_cache(path)
+            .expect("Failed to write cache");
+        let rulebox = RuleBox::from_cache(path);
+        std::fs::remove_file(path).ok();
+        let rulebox = rulebox.expect("Failed to load cache");
+
+        // Texts of different lengths are scanned side by side, in batches that
+        // don't divide the number of texts
+        let mut texts: Vec<String> = Vec::new();
+        for (i, text) in TEXTS.iter().enumerate() {
+            texts.push(text.to_string());
+            texts.push(String::new());
+            texts.push(format!(
+                "{} {}",
+                "filler".repeat(i * 3),
+                text.to_lowercase()
+            ));
+        }
+        let labels = rulebox.assign_labels_vector(&texts);
+        for (text, labels) in texts.iter().zip(labels) {
+            let labels: HashSet<String> = labels.into_iter().collect();
+            assert_eq!(labels, expected(&rulebox, text), "text: {:?}", text);
+        }
+    }
+
+    #[test]
+    fn test_uncompiled_rulebox_falls_back_to_rules() {
+        let compiled = RuleBox::from_json(RULES).expect("Failed to load rules");
+        let uncompiled: RuleBox = serde_json::from_str(RULES).expect("Failed to parse rules");
+
+        // Patterns that were never compiled never match
+        assert!(uncompiled.assign_labels("Hello world").is_empty());
+        assert!(!compiled.assign_labels("Hello world").is_empty());
+    }
+
+    #[test]
+    fn test_invalid_patterns_are_rejected() {
+        let rules = |pattern: &str, flag: &str| {
+            format!(
+                r#"[{{"label": "bad", "rule": {{"or_patterns": [{{"pattern": "{}", "flags": ["{}"]}}]}}}}]"#,
+                pattern, flag
+            )
+        };
+
+        assert!(RuleBox::from_json(&rules("(unclosed", "i")).is_err());
+        assert!(RuleBox::from_json(&rules("hello", "x")).is_err());
+
+        // Too large to compile: the error names the pattern, not just the set
+        let error = RuleBox::from_json(&rules("\\\\w{2000}", "m"))
+            .expect_err("Oversized pattern loaded")
+            .to_string();
+        assert!(error.contains("\\w{2000}"), "error: {}", error);
+
+        // A valid pattern's own regex is built on demand for Rule::check
+        let rulebox = RuleBox::from_json(&rules("^hello", "m")).expect("Failed to load rules");
+        assert!(rulebox.rules[0].rule.check("Preamble\nhello"));
+        assert!(!rulebox.rules[0].rule.check("Preamble hello"));
+    }
+
+    #[test]
+    fn test_patterns_combine_as_written() {
+        // Patterns the regex crate accepts on their own, which pasting them into
+        // a combined pattern string would break
+        let rules = r#"[
+            {"label": "repeated_flag", "rule": {"or_patterns": [{"pattern": "hello", "flags": ["i", "i"]}]}},
+            {"label": "comment", "rule": {"or_patterns": [
+                {"pattern": "(?x) good \\s+ bye  # farewell"},
+                {"pattern": "(?x)see\\ ya # later"}
+            ]}},
+            {"label": "not_comment", "rule": {
+                "and_patterns": [{"pattern": "(?x)motion # any"}],
+                "not_patterns": [{"pattern": "(?x)adjourn # unless"}, {"pattern": "\\?"}]
+            }},
+            {"label": "reordered_flags", "rule": {"and_patterns": [
+                {"pattern": "^motion", "flags": ["m", "i"]},
+                {"pattern": "^motion", "flags": ["i", "m", "i"]}
+            ]}}
+        ]"#;
+        let rulebox = RuleBox::from_json(rules).expect("Failed to load rules");
+
+        for text in [
+            "HELLO there",
+            "good   bye",
+            "see ya",
+            "A motion",
+            "motion to adjourn",
+            "Preamble\nMOTION?",
+        ] {
+            let labels: HashSet<String> = rulebox.assign_labels(text).into_iter().collect();
+            assert_eq!(labels, expected(&rulebox, text), "text: {:?}", text);
+            assert!(!labels.is_empty(), "text: {:?}", text);
+        }
+    }
+}
@@ -53,7 +53,7 @@ mod tests {
             },
         ];
 
-        let mut rulebox = RuleBox(rules);
+        let mut rulebox = RuleBox::new(rules);
         rulebox.compile().expect("Failed to compile rules");
 
         let texts = vec![